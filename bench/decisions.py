@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Checks how answers are counted: every approval request is replayed through the
+UI with dialogs that approve, reject, or are left unanswered (as when a dialog
+times out or is closed), and the requests_total metric must count them as
+approved, rejected and timed_out. Unanswered requests must still reach clef as
+rejected, since it wants a yes or a no.
+
+    python3 bench/decisions.py    # exits with 1 on a mismatch
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import argparse
+import json
+import logging
+import tempfile
+
+import gtkui
+from gtkapp.backends import PolicyDialogs
+from gtkapp.metrics import Metrics
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+METHODS = ("ApproveTx", "ApproveSignData", "ApproveNewAccount")
+EXPECTED = {True: "approved", False: "rejected", None: "timed_out"}
+
+
+def replay(corpus, approve, batch):
+    """ :return: (decisions counted, by method; approved values of the replies) """
+    (fd, results) = tempfile.mkstemp(prefix="gtkui-bench-", suffix=".json")
+    os.close(fd)
+    cmd = [sys.executable, os.path.join(HERE, "fake_clef.py"), corpus, results, "1", "8"]
+    ui = PolicyDialogs(approve=approve, password="bench")
+    review = gtkui.ReviewQueue(gather=0.1, ui=ui) if batch else None
+    metrics = Metrics()
+    (server, proc) = gtkui.connectHandler(cmd, gtkui.StdIOHandler(review=review, ui=ui),
+                                          workers=8, metrics=metrics)
+    replies = []
+    server.trace = lambda direction, context, message: direction == '<--' and replies.append(
+        json.loads(message).get('result', {}).get('approved', 'missing'))
+    try:
+        server.serve_forever()
+    except EOFError:
+        pass
+    proc.wait()
+    os.unlink(results)
+    decisions = {}
+    for ((name, labels), count) in metrics.counters.items():
+        labels = dict(labels)
+        if name == "requests_total":
+            decisions[labels['method']] = labels['decision']
+    return (decisions, replies)
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--corpus', type=str, default=os.path.join(HERE, "corpus.jsonl"),
+    help="JSON lines file of requests; only the approval requests are used")
+
+
+def main(args):
+    logging.getLogger("gtkui").setLevel(logging.CRITICAL)
+    (fd, corpus) = tempfile.mkstemp(prefix="gtkui-bench-", suffix=".jsonl")
+    with os.fdopen(fd, "w") as out, open(args.corpus) as f:
+        for line in f:
+            if line.strip() and json.loads(line)['method'] in METHODS:
+                out.write(line)
+
+    status = 0
+    for batch in (False, True):
+        for (approve, expected) in EXPECTED.items():
+            (decisions, replies) = replay(corpus, approve, batch)
+            wrong = {m: d for (m, d) in decisions.items() if d != expected}
+            sent = set(replies) - {bool(approve)}
+            print("{:<8} {:<10} {}".format("batch" if batch else "single", expected,
+                                           "ok" if not (wrong or sent) else "FAILED"))
+            if wrong:
+                print("    counted as {}".format(wrong))
+                status = 1
+            if sent:
+                print("    replied approved={} to clef".format(sorted(sent, key=str)))
+                status = 1
+    os.unlink(corpus)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+A stand-in for `clef --stdio-ui`, for benchmarking the UI without a signer.
+
+It sends the requests of a corpus (one JSON-RPC request per line, without an id)
+to the UI on stdout, and reads the replies on stdin. At most `window` requests
+are in flight at any time. Once every request has its reply, the latency of each
+one and the total elapsed time are written to the results file, as json.
+
+    fake_clef.py corpus.jsonl results.json [repeat] [window]
+"""
+
+import json
+import sys
+import threading
+import time
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() and not line.startswith("#")]
+
+
+def main(argv):
+    (corpus, results) = argv[:2]
+    repeat = int(argv[2]) if len(argv) > 2 else 1
+    window = int(argv[3]) if len(argv) > 3 else 1
+    requests = load(corpus)
+    total = len(requests) * repeat
+
+    slots = threading.Semaphore(window)
+    lock = threading.Lock()
+    sent = {}
+    latencies = []
+    errors = []
+
+    def read():
+        for line in sys.stdin.buffer:
+            now = time.perf_counter()
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            with lock:
+                (method, start) = sent.pop(reply.get('id'), (None, None))
+            if method is None:
+                continue
+            latencies.append((method, now - start))
+            if 'error' in reply:
+                errors.append((method, reply['error'].get('message')))
+            slots.release()
+            if len(latencies) == total:
+                return
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    out = sys.stdout.buffer
+    rid = 0
+    begin = time.perf_counter()
+    for i in range(repeat):
+        for request in requests:
+            slots.acquire()
+            rid += 1
+            message = json.dumps(dict(request, jsonrpc="2.0", id=rid)).encode('utf-8') + b"\n"
+            with lock:
+                sent[rid] = (request['method'], time.perf_counter())
+            out.write(message)
+            out.flush()
+    reader.join()
+    elapsed = time.perf_counter() - begin
+
+    with open(results, "w") as f:
+        json.dump({"elapsed": elapsed, "latencies": latencies, "errors": errors}, f)
+    # Closing stdout ends the UI's serve loop, like a signer shutting down
+    out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
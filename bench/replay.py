@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Replays a corpus of clef UI requests through the UI, and reports latency and
+throughput of the path parse -> dispatch -> render -> reply.
+
+No signer or display is needed: requests come from a stand-in signer process
+(fake_clef.py) and dialogs are answered right away by the policy backend. What
+is left is the cost of the UI itself, which should stay far below the time a
+human takes to read a dialog.
+
+    python3 bench/replay.py --repeat 200 --window 8
+    python3 bench/replay.py --max-p99 5    # exits with 1 if p99 is above 5 ms
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import argparse
+import json
+import logging
+import tempfile
+from collections import defaultdict
+
+import gtkui
+from gtkapp.backends import PolicyDialogs
+from gtkapp.metrics import Metrics
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+PASSWORD = "bench"
+
+
+def percentile(values, p):
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def report(results, out=sys.stdout):
+    by_method = defaultdict(list)
+    for (method, seconds) in results['latencies']:
+        by_method[method].append(seconds)
+    everything = sorted(s for (m, s) in results['latencies'])
+
+    out.write("{:<20} {:>8} {:>10} {:>10} {:>10}\n".format("method", "count", "p50 ms", "p99 ms", "max ms"))
+    for (method, values) in sorted(by_method.items()) + [("all", everything)]:
+        values.sort()
+        out.write("{:<20} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}\n".format(
+            method, len(values), 1000 * percentile(values, 50), 1000 * percentile(values, 99),
+            1000 * values[-1]))
+    out.write("\n{} requests in {:.2f}s: {:.0f} requests/sec\n".format(
+        len(everything), results['elapsed'], len(everything) / results['elapsed']))
+    if results['errors']:
+        out.write("{} requests failed, e.g. {}: {}\n".format(len(results['errors']), *results['errors'][0]))
+    return 1000 * percentile(everything, 99)
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--corpus', type=str, default=os.path.join(HERE, "corpus.jsonl"),
+    help="JSON lines file of requests to replay (method and params, no id)")
+parser.add_argument('--repeat', type=int, default=100,
+    help="Number of times to replay the corpus")
+parser.add_argument('--window', type=int, default=8,
+    help="Max number of requests in flight")
+parser.add_argument('--dialogs', type=int, default=4,
+    help="Number of approval workers, as gtkui --dialogs")
+parser.add_argument('--batch', action='store_true',
+    help="Go through the review queue, as gtkui --batch")
+parser.add_argument('--max-p99', type=float, default=None,
+    help="Exit with status 1 if the overall p99 latency exceeds this many milliseconds")
+
+
+def main(args):
+    (fd, results) = tempfile.mkstemp(prefix="gtkui-bench-", suffix=".json")
+    os.close(fd)
+    cmd = [sys.executable, os.path.join(HERE, "fake_clef.py"), args.corpus, results,
+           str(args.repeat), str(args.window)]
+
+    # Every ShowError would be logged otherwise
+    logging.getLogger("gtkui").setLevel(logging.CRITICAL)
+    # Approves everything right away, and lists every account
+    ui = PolicyDialogs(approve=True, password=PASSWORD)
+    review = gtkui.ReviewQueue(gather=0, ui=ui) if args.batch else None
+    handler = gtkui.StdIOHandler(review=review, ui=ui)
+    workers = max(args.dialogs, args.window) if args.batch else args.dialogs
+    (server, proc) = gtkui.connectHandler(cmd, handler, workers=workers,
+                                          max_pending=max(32, args.window), metrics=Metrics())
+    try:
+        # The stand-in closes its end once every request has its reply
+        server.serve_forever()
+    except EOFError:
+        pass
+    code = proc.wait()
+    if code != 0:
+        # Its stderr went to the gtkui log
+        print("The stand-in signer failed with exit code {}".format(code))
+        return 2
+    with open(results) as f:
+        data = json.load(f)
+    os.unlink(results)
+
+    p99 = report(data)
+    if args.max_p99 is not None and p99 > args.max_p99:
+        print("p99 of {:.3f} ms exceeds the budget of {} ms".format(p99, args.max_p99))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Checks the cold start cost of gtkui: the time to import it in a fresh
+interpreter (over that of an empty interpreter), and that the import does not
+load anything only needed later on: gi and Gtk (loaded by the gtk backend while
+the signer starts), argparse (only when run as a program), the json-rpc protocol
+(only once the signer runs).
+
+The signer services start the UI on demand, so this adds directly to the
+latency of the first request.
+
+    python3 bench/startup.py                # exits with 1 if above BUDGET ms
+    python3 bench/startup.py --budget 60    # ... or above 60 ms
+"""
+
+import os
+import sys
+import argparse
+import json
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Modules which must not be loaded by importing gtkui
+DEFERRED = ("gi", "gi.repository.Gtk", "argparse", "tinyrpc.protocols.jsonrpc", "decimal")
+
+PROBE = "import sys, json; import gtkui; print(json.dumps(sorted(sys.modules)))"
+
+# About twice the import time measured on a slow machine (120 ms), so that only a
+# real regression trips it, not noise
+BUDGET = 250
+
+
+def run(code, env=None):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+    return (time.perf_counter() - start, output)
+
+
+def slowest(count=10):
+    """ The modules with the largest own import time, from -X importtime """
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import gtkui"], cwd=ROOT,
+                         check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stderr
+    rows = []
+    for line in err.decode().splitlines()[1:]:
+        (own, cumulative, name) = line.split("|")
+        rows.append((int(own.split(":")[1]), int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--runs', type=int, default=20,
+    help="Number of fresh interpreters to time; the median is reported")
+parser.add_argument('--budget', type=float, default=BUDGET,
+    help="Exit with status 1 if the median import time exceeds this many milliseconds "
+         "(default {}, 0 for no budget)".format(BUDGET))
+
+
+def main(args):
+    # Once, to write the byte code caches
+    (elapsed, modules) = run(PROBE)
+    loaded = [name for name in DEFERRED if name in json.loads(modules)]
+
+    baseline = sorted(run("pass")[0] for i in range(args.runs))
+    imports = sorted(run("import gtkui")[0] for i in range(args.runs))
+    cost = 1000 * (imports[len(imports) // 2] - baseline[len(baseline) // 2])
+
+    print("{:>10} {:>10}  module".format("own us", "total us"))
+    for (own, cumulative, name) in slowest():
+        print("{:>10} {:>10}  {}".format(own, cumulative, name))
+    print("\nimport gtkui: {:.1f} ms (median of {}, over an empty interpreter)".format(cost, args.runs))
+
+    status = 0
+    if loaded:
+        print("Loaded on import, but should be deferred: {}".format(", ".join(loaded)))
+        status = 1
+    if args.budget and cost > args.budget:
+        print("Import time of {:.1f} ms exceeds the budget of {} ms".format(cost, args.budget))
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
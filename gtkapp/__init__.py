@@ -1,10 +1,35 @@
-from .gtksign import (
-    message,
-    error,
-    warning,
-    question,
-    questionAndPassword,
-    entry,
-    password,
+# The dialogs are loaded on first use, so that importing gtkapp does not load gi;
+# headless backends (see gtkapp.backends) never load it at all.
+__all__ = [
+    "message",
+    "error",
+    "warning",
+    "question",
+    "questionAndPassword",
+    "entry",
+    "password",
+    "message_async",
+    "error_async",
+    "warning_async",
+    "question_async",
+    "questionAndPassword_async",
+    "entry_async",
+    "password_async",
+    "zlist",
+    "zlist_async",
+    "batchReview",
+    "batchReview_async",
+    "run_main_loop",
+    "quit_main_loop",
+    "on_unix_signal",
+    "watch_fd",
+    "set_dialog_observer",
+    "on_screen_lock",
+]
 
-)
+
+def __getattr__(name):
+    if name in __all__:
+        from . import gtksign
+        return getattr(gtksign, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,276 @@
+"""
+An append-only journal of approval decisions, one json record per line.
+
+Records are handed to a background writer, which writes whatever has queued up
+since its last write in one go, and fsyncs once per such group. Approvals never
+wait for the disk, and a burst of them costs one fsync, not one each.
+
+Once the journal grows past max_bytes it is rotated: the segment is renamed,
+compressed, and described by a line in the index next to it
+
+    audit.jsonl            the current segment
+    audit.jsonl.1.gz       rotated segments, oldest first
+    audit.jsonl.index      per rotated segment: file, time range, accounts, count
+
+so queries by account and time range only decompress the segments that can
+match. To query a journal:
+
+    python3 -m gtkapp.audit ~/.clef/audit.jsonl --account 0x... --since 2026-01-01
+"""
+
+import datetime
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+log = logging.getLogger("gtkui")
+
+MAX_BYTES = 16 * 1024 * 1024
+# Max number of records written (and fsynced) as one group
+MAX_GROUP = 1024
+
+_CLOSE = object()
+
+
+def _accounts(record):
+    accounts = set(record.get('accounts') or [])
+    if record.get('account'):
+        accounts.add(record['account'])
+    return set(a.lower() for a in accounts)
+
+
+class _Segment(object):
+    """ What the index says about a segment """
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.accounts = set()
+        self.count = 0
+
+    def add(self, record):
+        if self.start is None:
+            (self.start, self.end) = (record['time'], record['time'])
+        # Records from concurrent approvals may be a little out of order
+        self.start = min(self.start, record['time'])
+        self.end = max(self.end, record['time'])
+        self.accounts |= _accounts(record)
+        self.count += 1
+
+    def entry(self, name):
+        return {"file": name, "start": self.start, "end": self.end,
+                "accounts": sorted(self.accounts), "count": self.count}
+
+
+class AuditJournal(object):
+    """
+    Writes audit records on a background thread, in groups.
+
+    :param path: the journal file
+    :type path: str
+    :param max_bytes: rotate the journal once it is larger than this
+    :type max_bytes: int
+    """
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.segment = _Segment()
+        for record in _scan(path):
+            self.segment.add(record)
+        self.file = open(path, "ab")
+        self.thread = threading.Thread(target=self._write_loop, name="audit", daemon=True)
+        self.thread.start()
+
+    def record(self, **fields):
+        """ Queues a record; returns right away """
+        fields.setdefault('time', time.time())
+        self.queue.put(fields)
+
+    def sync(self):
+        """ Waits until everything recorded so far is on disk """
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        """ Writes out what is queued, and stops the writer """
+        self.queue.put(_CLOSE)
+        self.thread.join()
+
+    def _write_loop(self):
+        while True:
+            # Whatever queued up while the last group was written is the next group
+            group = [self.queue.get()]
+            while len(group) < MAX_GROUP:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in group if isinstance(r, dict)]
+            try:
+                self._write(records)
+            except (OSError, ValueError) as e:
+                log.error("Could not write %d audit record(s): %s", len(records), e)
+            for item in group:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if _CLOSE in group:
+                self.file.close()
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        data = b"".join(json.dumps(r, sort_keys=True).encode('utf-8') + b"\n" for r in records)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        for record in records:
+            self.segment.add(record)
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """ Compresses the current segment, adds it to the index, and starts a new one """
+        self.file.close()
+        # Older segments may have been pruned: number on from the newest one on
+        # disk or in the index, and never overwrite anything (e.g. left over
+        # from a crash mid-rotation)
+        numbers = [_number(self.path, segment) for segment in _segments(self.path)]
+        numbers += [_number(os.path.basename(self.path), name) for name in _indexed(self.path)]
+        number = max(numbers or [0])
+        while True:
+            number += 1
+            name = "{}.{}.gz".format(os.path.basename(self.path), number)
+            rotated = os.path.join(os.path.dirname(os.path.abspath(self.path)), name)
+            if not os.path.exists(rotated) and not os.path.exists(rotated[:-3]):
+                break
+        os.rename(self.path, rotated[:-3])
+        self.file = open(self.path, "ab")
+        with open(rotated[:-3], "rb") as src, gzip.open(rotated + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(rotated + ".tmp", rotated)
+        os.unlink(rotated[:-3])
+        with open(self.path + ".index", "a") as index:
+            index.write(json.dumps(self.segment.entry(name)) + "\n")
+            index.flush()
+            os.fsync(index.fileno())
+        log.info("Rotated audit journal to %s", rotated)
+        self.segment = _Segment()
+
+
+def _scan(path):
+    """ The records of a segment; a torn last line (from a crash) is skipped """
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def _number(path, segment):
+    """ The number of a rotated segment, path.N.gz """
+    return int(segment[len(path) + 1:-3])
+
+
+def _segments(path):
+    """ The rotated segments, oldest first """
+    return sorted(glob.glob(glob.escape(path) + ".*.gz"), key=lambda segment: _number(path, segment))
+
+
+def _indexed(path):
+    """ The index entries of the rotated segments, by file name """
+    indexed = {}
+    try:
+        with open(path + ".index") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                indexed[entry['file']] = entry
+    except FileNotFoundError:
+        pass
+    return indexed
+
+
+def query(path, account=None, since=None, until=None):
+    """
+    Yields the records of the journal for the account (if given), within the time
+    range (epoch seconds, if given), oldest first.
+    """
+    if account is not None:
+        account = account.lower()
+    indexed = _indexed(path)
+
+    def wanted(entry):
+        if entry is None:
+            # Rotated, but not indexed: a crash came in between
+            return True
+        if since is not None and entry['end'] is not None and entry['end'] < since:
+            return False
+        if until is not None and entry['start'] is not None and entry['start'] > until:
+            return False
+        return account is None or account in entry['accounts']
+
+    files = [f for f in _segments(path) if wanted(indexed.get(os.path.basename(f)))]
+    for f in files + [path]:
+        for record in _scan(f):
+            if since is not None and record['time'] < since:
+                continue
+            if until is not None and record['time'] > until:
+                continue
+            if account is not None and account not in _accounts(record):
+                continue
+            yield record
+
+
+def _when(value):
+    """ Epoch seconds, or an ISO date / datetime (local time) """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def main(argv):
+    # Only used by the query tool, gtkui does not need it loaded
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python3 -m gtkapp.audit",
+                                     description="Query an audit journal")
+    parser.add_argument('journal', help="The journal file")
+    parser.add_argument('--account', help="Only decisions about this account")
+    parser.add_argument('--since', type=_when, help="Only decisions at or after this time")
+    parser.add_argument('--until', type=_when, help="Only decisions at or before this time")
+    parser.add_argument('--json', action='store_true', help="Print the raw records")
+    args = parser.parse_args(argv)
+
+    for record in query(args.journal, args.account, args.since, args.until):
+        if args.json:
+            print(json.dumps(record, sort_keys=True))
+            continue
+        print("{} {:<18} {:<9} {:<20} {} {} {}".format(
+            datetime.datetime.fromtimestamp(record['time']).isoformat(timespec='seconds'),
+            record.get('method', ''), record.get('decision', ''), record.get('by', ''),
+            record.get('account') or ",".join(record.get('accounts') or []) or '-',
+            record.get('origin', ''), record.get('digest', '')[:16]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,314 @@
+"""
+Dialog backends. The UI asks its questions through a backend, which is any object
+(or module) with the dialog functions of gtkapp.gtksign that the UI uses:
+
+    question, questionAndPassword, password, zlist, batchReview, message, error,
+    warning, and the _async form of each, returning a Future
+
+and the functions to run the main loop, which everything else hangs off:
+
+    run_main_loop, quit_main_loop, watch_fd, on_unix_signal, on_screen_lock,
+    set_dialog_observer
+
+Available backends:
+
+    gtk       dialogs on the desktop (gtkapp.gtksign)
+    policy    no dialogs at all: everything not decided by a rule is rejected
+    terminal  questions are asked on the controlling terminal
+
+The headless backends never load gi, and run their main loop on a selector.
+"""
+
+import logging
+import os
+import selectors
+import signal
+import termios
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+log = logging.getLogger("gtkui")
+
+BACKENDS = ("gtk", "policy", "terminal")
+
+
+def get_backend(name, **options):
+    """
+    :param name: one of BACKENDS
+    :return: the backend; options are passed on to the headless ones
+    """
+    if name == "gtk":
+        from . import gtksign
+        return gtksign
+    if name == "policy":
+        return PolicyDialogs(**options)
+    if name == "terminal":
+        return TerminalDialogs(**options)
+    raise ValueError("Unknown dialog backend: {}".format(name))
+
+
+def _rows(columns, items):
+    """ Unflattens zlist items into rows of len(columns) """
+    items = list(items)
+    if len(items) % len(columns):
+        items.extend([''] * (len(columns) - len(items) % len(columns)))
+    rows = iter(items)
+    return list(zip(*[rows] * len(columns)))
+
+
+def _pick(row, print_columns):
+    """ What zlist returns for a selected row """
+    if print_columns is None:
+        return list(row)
+    return row[print_columns]
+
+
+class HeadlessLoop(object):
+    """
+    A main loop without Gtk: a selector over the watched fds, and a pipe to wake
+    it up from other threads.
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        (self.wakeup, self.waker) = os.pipe()
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.running = False
+        self.observer = None
+
+    def run_main_loop(self):
+        self.running = True
+        while self.running:
+            for (key, events) in self.selector.select():
+                if key.fd == self.wakeup:
+                    os.read(self.wakeup, 512)
+                elif not key.data():
+                    self.selector.unregister(key.fd)
+
+    def quit_main_loop(self):
+        self.running = False
+        os.write(self.waker, b"\0")
+
+    def watch_fd(self, fd, callback):
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+        # May be called from another thread, while the loop waits without this fd
+        os.write(self.waker, b"\0")
+
+    def on_unix_signal(self, signum, callback):
+        # Python runs signal handlers on the main thread, which is the one
+        # running the loop, so the callback can be called right away
+        signal.signal(signum, lambda signum, frame: callback())
+
+    def on_screen_lock(self, callback):
+        return False
+
+    def set_dialog_observer(self, observer):
+        self.observer = observer
+
+
+class PolicyDialogs(HeadlessLoop):
+    """
+    Answers every dialog from a fixed policy, without asking anyone.
+
+    :param approve: whether to approve (questions, listings, reviews), or reject;
+                    None leaves every question unanswered, as a dialog timing out
+    :type approve: bool
+    :param password: the password handed out along with approvals
+    :type password: str
+    """
+    def __init__(self, approve=False, password=None):
+        super(PolicyDialogs, self).__init__()
+        self.approve = approve
+        self.approve_password = password
+
+    def _call(self, title, func, *args):
+        """ Runs a dialog implementation, and returns a Future for its answer """
+        future = Future()
+        start = time.monotonic()
+        try:
+            future.set_result(func(title, *args))
+        except Exception as e:
+            future.set_exception(e)
+        if self.observer is not None:
+            self.observer(title, 0.0, time.monotonic() - start)
+        return future
+
+    def _question(self, title, text, details):
+        log.info("Policy %s: %s", {True: "approved", None: "left unanswered"}.get(self.approve, "rejected"),
+                 title)
+        return self.approve
+
+    def _password(self, title, text):
+        return self.approve_password
+
+    def _question_and_password(self, title, text, details):
+        answer = self._question(title, text, details)
+        if not answer:
+            return (answer, None)
+        return (True, self._password("password", "Enter password"))
+
+    def _zlist(self, title, columns, items, print_columns, text, multiple):
+        rows = _rows(columns, items) if self._question(title, text, None) else []
+        if multiple:
+            return [_pick(row, print_columns) for row in rows]
+        return [_pick(rows[0], print_columns)] if rows else None
+
+    def _batch_review(self, title, columns, items, text):
+        rows = _rows([None] + list(columns), items)
+        answer = self._question(title, text, None)
+        if not answer:
+            return None if answer is None else ([], None)
+        return (list(range(len(rows))), self._password("password", "Enter password"))
+
+    def _show(self, title, level, text):
+        getattr(log, level)("%s %s", title, text)
+
+    def question(self, title="", text="", width=None, height=None, timeout=None, details=None):
+        return self.question_async(title, text, width, height, timeout, details).result()
+
+    def question_async(self, title="", text="", width=None, height=None, timeout=None, details=None):
+        return self._call(title, self._question, text, details)
+
+    def questionAndPassword(self, title="", text="", width=None, height=None, timeout=None,
+                            details=None):
+        return self.questionAndPassword_async(title, text, width, height, timeout, details).result()
+
+    def questionAndPassword_async(self, title="", text="", width=None, height=None, timeout=None,
+                                  details=None):
+        return self._call(title, self._question_and_password, text, details)
+
+    def password(self, text="", placeholder="", title="", width=None, height=None, timeout=None):
+        return self.password_async(text, placeholder, title, width, height, timeout).result()
+
+    def password_async(self, text="", placeholder="", title="", width=None, height=None, timeout=None):
+        return self._call(title, self._password, text)
+
+    def zlist(self, columns, items, print_columns=None, text="", title="", width=None,
+              height=None, timeout=None, multiple=False, select_all=False):
+        return self.zlist_async(columns, items, print_columns, text, title, width, height,
+                                timeout, multiple, select_all).result()
+
+    def zlist_async(self, columns, items, print_columns=None, text="", title="", width=None,
+                    height=None, timeout=None, multiple=False, select_all=False):
+        return self._call(title, self._zlist, columns, items, print_columns, text, multiple)
+
+    def batchReview(self, columns, items, text="", title="", width=None, height=None, timeout=None):
+        return self.batchReview_async(columns, items, text, title, width, height, timeout).result()
+
+    def batchReview_async(self, columns, items, text="", title="", width=None, height=None,
+                          timeout=None):
+        return self._call(title, self._batch_review, columns, items, text)
+
+    def message(self, title="", text="", width=None, height=None, timeout=None):
+        return self.message_async(title, text).result()
+
+    def message_async(self, title="", text="", width=None, height=None, timeout=None):
+        return self._call(title, self._show, "info", text)
+
+    def warning(self, title="", text="", width=None, height=None, timeout=None):
+        return self.warning_async(title, text).result()
+
+    def warning_async(self, title="", text="", width=None, height=None, timeout=None):
+        return self._call(title, self._show, "warning", text)
+
+    def error(self, title="", text="", width=None, height=None, timeout=None):
+        return self.error_async(title, text).result()
+
+    def error_async(self, title="", text="", width=None, height=None, timeout=None):
+        return self._call(title, self._show, "error", text)
+
+
+class TerminalDialogs(PolicyDialogs):
+    """
+    Asks on the controlling terminal. Questions are asked one at a time, in the
+    order they come in; dialog timeouts are not supported.
+
+    :param tty: the terminal to ask on
+    :type tty: str
+    """
+    def __init__(self, tty="/dev/tty"):
+        super(TerminalDialogs, self).__init__()
+        self.input = open(tty, "r")
+        self.output = open(tty, "w")
+        # One thread asks all questions, so that they don't interleave
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def _call(self, title, func, *args):
+        start = time.monotonic()
+
+        def ask():
+            shown = time.monotonic()
+            try:
+                return func(title, *args)
+            finally:
+                if self.observer is not None:
+                    self.observer(title, shown - start, time.monotonic() - shown)
+        return self.pool.submit(ask)
+
+    def _write(self, text):
+        self.output.write(text)
+        self.output.flush()
+
+    def _ask(self, prompt):
+        self._write(prompt)
+        return self.input.readline().strip().lower()
+
+    def _header(self, title, text):
+        self._write("\n== {} ==\n{}\n".format(title, text or ""))
+
+    def _question(self, title, text, details):
+        self._header(title, text)
+        while True:
+            answer = self._ask("Approve? [y/N{}] ".format("/d(etails)" if details else ""))
+            if answer == "d" and details:
+                self._write(details + "\n")
+                continue
+            return answer in ("y", "yes")
+
+    def _password(self, title, text):
+        self._write("{}: ".format(text or "Password"))
+        fd = self.input.fileno()
+        echo = termios.tcgetattr(fd)
+        quiet = list(echo)
+        quiet[3] &= ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSADRAIN, quiet)
+        try:
+            return self.input.readline().rstrip("\n")
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, echo)
+            self._write("\n")
+
+    def _zlist(self, title, columns, items, print_columns, text, multiple):
+        rows = _rows(columns, items)
+        self._header(title, text)
+        self._write("     " + " | ".join(columns) + "\n")
+        for (i, row) in enumerate(rows):
+            self._write("{:>4} ".format(i + 1) + " | ".join(str(v) for v in row) + "\n")
+        prompt = "Rows (e.g. 1,3 or 'a' for all; empty for none): " if multiple else "Row (empty for none): "
+        answer = self._ask(prompt)
+        if answer in ("a", "all") and multiple:
+            chosen = rows
+        else:
+            chosen = [rows[int(n) - 1] for n in answer.replace(",", " ").split()
+                      if n.isdigit() and 0 < int(n) <= len(rows)]
+        if multiple:
+            return [_pick(row, print_columns) for row in chosen]
+        return [_pick(chosen[0], print_columns)] if chosen else None
+
+    def _batch_review(self, title, columns, items, text):
+        rows = _rows(["#"] + list(columns), items)
+        self._header(title, text)
+        self._write("     " + " | ".join(columns) + "\n")
+        for row in rows:
+            self._write("{:>4} ".format(row[0]) + " | ".join(str(v) for v in row[1:]) + "\n")
+        answer = self._ask("Requests to approve (e.g. 0,2 or 'a' for all; empty to reject all): ")
+        if answer in ("a", "all"):
+            selected = list(range(len(rows)))
+        else:
+            selected = [int(n) for n in answer.replace(",", " ").split()
+                        if n.isdigit() and int(n) < len(rows)]
+        if not selected:
+            return ([], None)
+        return (selected, self._password("password", "Enter password"))
+
+    def _show(self, title, level, text):
+        self._write("\n[{}] {} {}\n".format(level, title, text or ""))
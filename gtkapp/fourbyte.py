@@ -0,0 +1,212 @@
+"""
+A compact, memory mapped index of 4-byte function selectors, used to show which
+function a transaction calls, and with which arguments.
+
+The index is built once from the 4byte.json shipped with clef, and stored next
+to it (or in ~/.cache/gtksigner if that directory is not writeable). Layout:
+
+    magic (8 bytes) | count (4 bytes)
+    selectors       count * 4 bytes, sorted
+    offsets         (count + 1) * 4 bytes, into the signature blob
+    signatures      utf-8
+
+All integers are big endian. Looking up a selector is a binary search over the
+mapped selectors; nothing is loaded into memory up front.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b"4BYTEIX1"
+HEADER = struct.Struct(">8sI")
+CACHE_DIR = os.path.expanduser("~/.cache/gtksigner")
+
+
+def build(jsonpath, indexpath):
+    """ Compiles the 4byte json file into an index file """
+    with open(jsonpath) as f:
+        signatures = json.load(f)
+
+    entries = []
+    for (selector, signature) in signatures.items():
+        selector = selector[2:] if selector.startswith("0x") else selector
+        try:
+            entries.append((bytes.fromhex(selector), signature.encode("utf-8")))
+        except ValueError:
+            continue
+    entries = [e for e in entries if len(e[0]) == 4]
+    entries.sort()
+
+    offsets = [0]
+    for (selector, signature) in entries:
+        offsets.append(offsets[-1] + len(signature))
+
+    tmp = indexpath + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        f.write(b"".join(selector for (selector, signature) in entries))
+        f.write(struct.pack(">{}I".format(len(offsets)), *offsets))
+        f.write(b"".join(signature for (selector, signature) in entries))
+    os.replace(tmp, indexpath)
+
+
+class _Selectors(object):
+    """ The sorted selectors in the mapped file, as a sequence for bisect """
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = HEADER.size + 4 * i
+        return self.data[start:start + 4]
+
+
+class SelectorIndex(object):
+    """
+    Lookups of function signatures by selector.
+
+    :param jsonpath: path to the 4byte json file
+    :type jsonpath: str
+    """
+    def __init__(self, jsonpath):
+        self.jsonpath = jsonpath
+        self.data = None
+        self.selectors = None
+
+    def _indexpath(self):
+        path = self.jsonpath + ".idx"
+        if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            return path
+        return os.path.join(CACHE_DIR, os.path.basename(path))
+
+    def open(self):
+        """ Maps the index, building it first if it is missing or outdated """
+        indexpath = self._indexpath()
+        try:
+            stale = os.stat(indexpath).st_mtime < os.stat(self.jsonpath).st_mtime
+        except FileNotFoundError:
+            stale = True
+        if stale:
+            os.makedirs(os.path.dirname(os.path.abspath(indexpath)), exist_ok=True)
+            build(self.jsonpath, indexpath)
+
+        with open(indexpath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, count) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a selector index: {}".format(indexpath))
+        self.count = count
+        self.offsets = HEADER.size + 4 * count
+        self.blob = self.offsets + 4 * (count + 1)
+        self.data = data
+        self.selectors = _Selectors(data, count)
+        return self
+
+    def lookup(self, selector):
+        """
+        :param selector: the selector, as bytes or as hex
+        :return: the function signature, or None if unknown (or not opened yet)
+        """
+        if self.selectors is None:
+            return None
+        if isinstance(selector, str):
+            selector = bytes.fromhex(selector[2:] if selector.startswith("0x") else selector)
+        i = bisect.bisect_left(self.selectors, selector)
+        if i == self.count or self.selectors[i] != selector:
+            return None
+        (start, end) = struct.unpack_from(">II", self.data, self.offsets + 4 * i)
+        return self.data[self.blob + start:self.blob + end].decode("utf-8")
+
+
+def _split_types(params):
+    """ Splits 'a,(b,c),d' at the top level commas """
+    (types, depth, current) = ([], 0, "")
+    for c in params:
+        if c == "," and depth == 0:
+            types.append(current)
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        current += c
+    if current:
+        types.append(current)
+    return types
+
+
+def _word(data, offset):
+    if offset + 32 > len(data):
+        raise ValueError("Calldata too short")
+    return data[offset:offset + 32]
+
+
+def _decode_static(typ, word):
+    if typ == "address":
+        return "0x" + word[12:].hex()
+    if typ == "bool":
+        return str(int.from_bytes(word, "big") != 0).lower()
+    if typ.startswith("uint"):
+        return str(int.from_bytes(word, "big"))
+    if typ.startswith("int"):
+        return str(int.from_bytes(word, "big", signed=True))
+    if typ.startswith("bytes"):
+        return "0x" + word[:int(typ[5:])].hex()
+    raise ValueError("Unsupported type " + typ)
+
+
+def _is_static(typ):
+    return typ in ("address", "bool") or (typ[:3] in ("uin", "int") and "[" not in typ) or \
+        (typ.startswith("bytes") and typ[5:].isdigit())
+
+
+def _decode(typ, data, head):
+    """ Decodes the argument of the given type, whose head is at the given offset """
+    if _is_static(typ):
+        return _decode_static(typ, _word(data, head))
+    offset = int.from_bytes(_word(data, head), "big")
+    length = int.from_bytes(_word(data, offset), "big")
+    if typ in ("bytes", "string"):
+        value = data[offset + 32:offset + 32 + length]
+        if len(value) < length:
+            raise ValueError("Calldata too short")
+        if typ == "string":
+            return repr(value.decode("utf-8", "replace"))
+        return "0x" + value.hex()
+    if typ.endswith("[]") and _is_static(typ[:-2]):
+        base = offset + 32
+        items = [_decode_static(typ[:-2], _word(data, base + 32 * i)) for i in range(length)]
+        return "[" + ", ".join(items) + "]"
+    raise ValueError("Unsupported type " + typ)
+
+
+def decodeCall(signature, calldata):
+    """
+    Decodes the arguments of a call.
+
+    :param signature: e.g. transfer(address,uint256)
+    :param calldata: the call data, including the selector
+    :type calldata: bytes
+    :return: list of (type, value) strings. Values which can't be decoded are
+             shown as '?'
+    """
+    params = signature[signature.index("(") + 1:signature.rindex(")")]
+    args = calldata[4:]
+    decoded = []
+    inline = False
+    for (i, typ) in enumerate(_split_types(params)):
+        # Tuples and fixed size arrays take up more than one head slot,
+        # the heads of anything after them can't be located
+        if inline or typ.startswith("(") or (typ.endswith("]") and not typ.endswith("[]")):
+            inline = True
+            decoded.append((typ, "?"))
+            continue
+        try:
+            decoded.append((typ, _decode(typ, args, 32 * i)))
+        except (ValueError, UnicodeDecodeError):
+            decoded.append((typ, "?"))
+    return decoded
@@ -5,14 +5,27 @@
 #! /usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import bisect
+import threading
+import time
+from concurrent.futures import Future
+
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib
+from gi.repository import Gtk, GLib, Gio
 
 
 DEFAULT_WIDTH = 330
 DEFAULT_HEIGHT = 120
 
+# Called with (title, seconds until shown, seconds shown) when a dialog closes
+_dialog_observer = None
+
+# Details are added to the text view this many characters at a time
+DETAILS_CHUNK = 16 * 1024
+# Details larger than this are not shown, only their size and hash
+DETAILS_MAX = 1024 * 1024
+
 
 class Base(object):
     def __init__(self, title, width, height, timeout):
@@ -22,6 +35,10 @@ class Base(object):
         self.timeout = timeout
         self.dialog = None
         self.response = None
+        self.callback = None
+        self.closed = False
+        self.requested = None
+        self.shown = None
 
     def init_dialog(self):
         # global config
@@ -31,26 +48,40 @@ class Base(object):
         if self.timeout:
             GLib.timeout_add_seconds(
                 self.timeout,
-                self._destroy,
-                self.dialog
+                self._timeout
             )
 
         if self.title:
             self.dialog.set_title(self.title)
         self.dialog.connect("destroy", self._destroy)
 
-    def run(self):
-        self.dialog.show()
+    def run(self, callback=None):
+        """ Shows the dialog on the running main loop, and returns immediately.
+        The callback is invoked with the response once the dialog is closed """
+        self.callback = callback
         self.dialog.connect("response", self._response)
-        Gtk.main()
+        self.dialog.show()
+        self.shown = time.monotonic()
+
+    def _timeout(self):
+        self._destroy(self.dialog)
+        return False
 
     def _response(self, dialog, response):
         self.set_response(response)
         self._destroy(self.dialog)
 
     def _destroy(self, dialog):
+        # Destroying the dialog emits 'destroy' again, only close once
+        if self.closed:
+            return
+        self.closed = True
         self.dialog.destroy()
-        Gtk.main_quit()
+        if _dialog_observer is not None and self.shown is not None:
+            now = time.monotonic()
+            _dialog_observer(self.title, self.shown - (self.requested or self.shown), now - self.shown)
+        if self.callback is not None:
+            self.callback(self.response)
 
     def set_response(self, response):
         self.response = response
@@ -83,6 +114,72 @@ class ZSimpleDialog(Base):
             self.dialog.set_markup(self.text)
 
 
+class ZDetailQuestion(Base):
+    """
+    A yes/no question with a plain text summary on top, and the details in a
+    scrollable text view below. The details are added to the view a chunk at a
+    time, as the user scrolls down to them, so large payloads open instantly.
+    Details over DETAILS_MAX are shown only by the size and hash of their payload,
+    if they carry them (as gtkui.Details do).
+    """
+    def __init__(self, text, details, *args, **kwargs):
+        super(ZDetailQuestion, self).__init__(*args, **kwargs)
+        self.text = text
+        self.details = details
+        self.loaded = 0
+        self.dialog = Gtk.Dialog()
+        self.init_dialog()
+
+    def init_dialog(self):
+        super(ZDetailQuestion, self).init_dialog()
+        content = self.dialog.get_content_area()
+
+        label = Gtk.Label()
+        label.set_text(self.text)
+        label.set_selectable(True)
+        label.set_line_wrap(True)
+        label.set_xalign(0)
+        content.pack_start(label, False, False, 5)
+
+        self.buffer = Gtk.TextBuffer()
+        view = Gtk.TextView(buffer=self.buffer)
+        view.set_editable(False)
+        view.set_cursor_visible(False)
+        view.set_monospace(True)
+        view.set_wrap_mode(Gtk.WrapMode.CHAR)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_min_content_height(200)
+        scrolled.add(view)
+        content.pack_start(scrolled, True, True, 5)
+
+        if len(self.details) > DETAILS_MAX:
+            # The hash of the rendered text would be of no use to check against,
+            # only that of the payload itself (see gtkui.Details)
+            if getattr(self.details, 'sha256', None) is not None:
+                self.buffer.set_text("Too large to display ({} bytes of data)\nsha256 of the data: {}".format(
+                    self.details.size, self.details.sha256))
+            else:
+                self.buffer.set_text("Too large to display ({} characters)".format(len(self.details)))
+        else:
+            self._load_chunk()
+            scrolled.get_vadjustment().connect("value-changed", self._on_scroll)
+        content.show_all()
+
+        self.dialog.add_buttons(Gtk.STOCK_NO, Gtk.ResponseType.NO,
+                                Gtk.STOCK_YES, Gtk.ResponseType.YES)
+
+    def _load_chunk(self):
+        chunk = self.details[self.loaded:self.loaded + DETAILS_CHUNK]
+        self.loaded += len(chunk)
+        self.buffer.insert(self.buffer.get_end_iter(), chunk)
+
+    def _on_scroll(self, adjustment):
+        # Load more once the user is within a page of the end
+        remaining = adjustment.get_upper() - adjustment.get_value() - adjustment.get_page_size()
+        if self.loaded < len(self.details) and remaining < adjustment.get_page_size():
+            self._load_chunk()
+
+
 class ZEntry(Base):
     def __init__(self, text, placeholder, *args, **kwargs):
         super(ZEntry, self).__init__(*args, **kwargs)
@@ -195,76 +292,126 @@ class ZEntryPassword(ZEntry):
 
 
 class ZList(Base):
-    def __init__(self, columns, items, print_columns, text, *args, **kwargs):
+    def __init__(self, columns, items, print_columns, text, *args, multiple=False,
+                 select_all=False, **kwargs):
         super(ZList, self).__init__(*args, **kwargs)
         self.columns = columns
         self.items = items
         self.print_columns = print_columns
         self.text = text
+        self.multiple = multiple
+        self.select_all = select_all
         self.selection = None
+        self.matching = None
         self.dialog = Gtk.Dialog()
         self.init_dialog()
 
     def init_dialog(self):
         super(ZList, self).init_dialog()
         len_col = len(self.columns)
-        coltypes = [str] * len_col
+        # The extra last column holds whether the row matches the filter
+        coltypes = [str] * len_col + [bool]
         store = Gtk.ListStore(*coltypes)
 
         # Zenity's Example is filling the cells row by row
         # (https://help.gnome.org/users/zenity/stable/list.html.en)
-        # To imitate this we probably need a helper to flatten the items
-        # example: [1,2,3,4,5] -> (1,2,3), (4,5,'')
-        def group(items, nb_cols):
-            for i in range(0, len(items), nb_cols):
-                group = items[i:i+nb_cols]
-                if len(group) == nb_cols:
-                    yield(tuple(group))
-                else:
-                    # fill empty indices with empty string
-                    yield(tuple(group + ['']*(nb_cols-len(group))))
-
-        for g in group(self.items, len_col):
-            store.append(g)
-
-        cell = Gtk.CellRendererText()
-        treeview = Gtk.TreeView(store)
-        treeview.set_border_width(40)
+        # so the items are flattened, e.g. [1,2,3,4,5] -> (1,2,3), (4,5,'')
+        items = list(self.items)
+        if len(items) % len_col:
+            items.extend([''] * (len_col - len(items) % len_col))
+        rows = iter(items)
+        # The store is filled before any view is attached to it, so nothing
+        # is laid out or sorted until all rows are in
+        self.iters = [store.append(row + (True,)) for row in zip(*[rows] * len_col)]
+        self.store = store
+        self._index(items, len_col)
+
+        # store -> filter -> sort -> view
+        self.filter = store.filter_new()
+        self.filter.set_visible_column(len_col)
+        sortable = Gtk.TreeModelSort(model=self.filter)
+
+        treeview = Gtk.TreeView(model=sortable)
+        treeview.set_enable_search(False)
         treeview.show()
-        treeview.get_selection().connect("changed", self._on_item_selected)
+        if self.multiple:
+            treeview.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+        else:
+            treeview.get_selection().connect("changed", self._on_item_selected)
+        self.treeview = treeview
 
         for i, column in enumerate(self.columns):
+            cell = Gtk.CellRendererText()
             tvcolumn = Gtk.TreeViewColumn(column)
-            tvcolumn.set_sort_column_id(0)
+            tvcolumn.set_sort_column_id(i)
             tvcolumn.pack_start(cell, True)
             tvcolumn.add_attribute(cell, 'text', i)
             treeview.append_column(tvcolumn)
 
-        hb = Gtk.HBox()
-        hb.show()
-        frame = Gtk.Frame()
+        if self.multiple and self.select_all:
+            treeview.get_selection().select_all()
+
+        content = self.dialog.get_content_area()
         if self.text:
             label = Gtk.Label()
             label.set_text(self.text)
+            label.set_xalign(0)
             label.show()
-            frame.set_label(self.text)
-        frame.show()
-        frame.add(treeview)
-        hb.pack_start(frame, True, True, 10)
-        self.dialog.get_content_area().add(hb)
+            content.pack_start(label, False, False, 5)
+
+        search = Gtk.SearchEntry()
+        search.set_placeholder_text("Filter")
+        search.connect("search-changed", self._on_filter)
+        search.show()
+        content.pack_start(search, False, False, 5)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_min_content_height(200)
+        scrolled.add(treeview)
+        scrolled.show()
+        content.pack_start(scrolled, True, True, 5)
+
         self.dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
                                 Gtk.STOCK_OK, Gtk.ResponseType.OK)
         self.dialog.set_default(
             self.dialog.get_widget_for_response(
                 Gtk.ResponseType.OK))
 
+    def _index(self, items, len_col):
+        """ Builds a sorted (value, row) index over all cells, for prefix lookups """
+        self.prefixes = sorted((str(value).lower(), i // len_col)
+                               for (i, value) in enumerate(items) if value != '')
+        self.keys = [key for (key, row) in self.prefixes]
+
+    def _lookup(self, prefix):
+        """ Returns the rows having a cell which starts with the prefix """
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff')
+        return set(row for (key, row) in self.prefixes[start:end])
+
+    def _on_filter(self, entry):
+        prefix = entry.get_text().strip().lower()
+        matching = self._lookup(prefix) if prefix else None
+        previous = self.matching
+        self.matching = matching
+        # Only touch the rows whose visibility changes
+        if previous is None:
+            previous = range(len(self.iters))
+        if matching is None:
+            changed = set(range(len(self.iters))) - set(previous)
+        else:
+            changed = set(previous).symmetric_difference(matching)
+        len_col = len(self.columns)
+        for row in changed:
+            self.store.set_value(self.iters[row], len_col, matching is None or row in matching)
+
     def _on_item_selected(self, selection):
         model, treeiter = selection.get_selected()
         if not treeiter:
             self.selection = None
             return
         if self.print_columns is None:
-            self.selection = [x for x in model[treeiter]]
+            self.selection = self._row(model[treeiter])
         else:
             try:
                 self.selection = [model[treeiter][self.print_columns]]
@@ -273,17 +420,181 @@ class ZList(Base):
             except TypeError:
                 print("Error: Column index must be integer")
 
+    def _row(self, row):
+        if self.print_columns is None:
+            return [row[i] for i in range(len(self.columns))]
+        return row[self.print_columns]
+
+    def _selected(self):
+        """ The selected rows, in multiple selection mode """
+        model, paths = self.treeview.get_selection().get_selected_rows()
+        return [self._row(model[path]) for path in paths]
+
     def set_response(self, response):
         if response == Gtk.ResponseType.OK:
+            if self.multiple:
+                self.selection = self._selected()
             self.response = self.selection
 
 
+class ZBatchReview(ZList):
+    """
+    Lists a number of pending requests. The selected rows are approved with a
+    single password, all other rows are rejected. The first column holds the
+    index of the request, and is what is returned for the selected rows.
+    """
+    def __init__(self, columns, items, text, *args, **kwargs):
+        self.password_widget = Gtk.Entry()
+        super(ZBatchReview, self).__init__(["#"] + columns, items, 0, text,
+                                           *args, multiple=True, **kwargs)
+
+    def init_dialog(self):
+        super(ZBatchReview, self).init_dialog()
+        self.dialog.get_widget_for_response(Gtk.ResponseType.CANCEL).set_label("Reject all")
+        self.dialog.get_widget_for_response(Gtk.ResponseType.OK).set_label("Approve selected")
+
+        hb = Gtk.HBox(spacing=20)
+        label = Gtk.Label()
+        label.set_text("Password")
+        hb.pack_start(label, False, False, 10)
+        self.password_widget.set_visibility(False)
+        self.password_widget.set_activates_default(True)
+        hb.pack_start(self.password_widget, True, True, 10)
+        hb.show_all()
+        self.dialog.get_content_area().add(hb)
+
+    def set_response(self, response):
+        if response == Gtk.ResponseType.OK:
+            selected = [int(x) for x in self._selected()]
+            self.response = (selected, self.password_widget.get_text())
+        elif response == Gtk.ResponseType.CANCEL:
+            # Rejected, as opposed to closed without an answer
+            self.response = ([], None)
+
+
+def run_main_loop():
+    """
+    Run the main loop which all dialogs are shown on. This should be called
+    once, from the main thread, and blocks until quit_main_loop is called.
+    """
+    Gtk.main()
+
+
+def quit_main_loop():
+    """
+    Stop the main loop. Safe to call from any thread.
+    """
+    GLib.idle_add(Gtk.main_quit)
+
+
+def set_dialog_observer(observer):
+    """
+    Set a callback to be invoked whenever a dialog closes, with the dialog title,
+    the seconds it took to show the dialog, and the seconds it was shown.
+    """
+    global _dialog_observer
+    _dialog_observer = observer
+
+
+def watch_fd(fd, callback):
+    """
+    Invoke the callback on the main loop whenever the fd is readable, or closed.
+    The watch is removed once the callback returns False.
+    """
+    def handler(source, condition):
+        return callback()
+    return GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT,
+                             GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, handler)
+
+
+def on_unix_signal(signum, callback):
+    """
+    Invoke the callback on the main loop whenever the process receives the signal.
+    Python signal handlers do not run while the main loop is blocked, this does.
+    """
+    def handler():
+        callback()
+        return True
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, handler)
+
+
+def on_screen_lock(callback):
+    """
+    Invoke the callback on the main loop whenever the screen saver activates.
+
+    :return: False if there is no session bus to listen on
+    """
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+    except GLib.Error:
+        return False
+
+    def changed(connection, sender, path, interface, signal, params):
+        if params.unpack()[0]:
+            callback()
+
+    for interface in ("org.freedesktop.ScreenSaver", "org.gnome.ScreenSaver"):
+        bus.signal_subscribe(None, interface, "ActiveChanged", None, None,
+                             Gio.DBusSignalFlags.NONE, changed)
+    return True
+
+
+def _on_loop(func, *args):
+    """ Runs func on the main loop thread """
+    if threading.current_thread() is threading.main_thread():
+        func(*args)
+        return
+
+    def idle():
+        func(*args)
+        return False
+    GLib.idle_add(idle)
+
+
+def _show(factory, convert=None):
+    """
+    Creates and shows a dialog on the main loop.
+
+    :param factory: callable creating the dialog (called on the main loop)
+    :param convert: optional callable to transform the dialog response
+    :return: a Future which resolves to the response when the dialog closes
+    """
+    future = Future()
+    requested = time.monotonic()
+
+    def done(response):
+        try:
+            future.set_result(convert(response) if convert else response)
+        except Exception as e:
+            future.set_exception(e)
+
+    def show():
+        try:
+            dialog = factory()
+            dialog.requested = requested
+            dialog.run(done)
+        except Exception as e:
+            future.set_exception(e)
+
+    _on_loop(show)
+    return future
+
+
+def _wait(future):
+    """
+    Blocks until the future resolves. Worker threads simply wait, whereas the
+    main thread keeps iterating the main loop so the dialog stays responsive.
+    """
+    if threading.current_thread() is threading.main_thread():
+        while not future.done():
+            Gtk.main_iteration()
+    return future.result()
+
+
 def _simple_dialog(dialog_type, text, title,
                    width, height, timeout):
-    dialog = ZSimpleDialog(dialog_type, text,
-                           title, width, height, timeout)
-    dialog.run()
-    return dialog.response
+    return _show(lambda: ZSimpleDialog(dialog_type, text,
+                                       title, width, height, timeout))
 
 
 def message(title="", text="", width=DEFAULT_WIDTH,
@@ -302,6 +613,14 @@ def message(title="", text="", width=DEFAULT_WIDTH,
     :param timeout: close the window after n seconds
     :type timeout: int
     """
+    return _wait(message_async(title, text, width, height, timeout))
+
+
+def message_async(title="", text="", width=DEFAULT_WIDTH,
+                  height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like message, but returns immediately with a Future for the response
+    """
     return _simple_dialog(Gtk.MessageType.INFO,
                           text, title, width, height, timeout)
 
@@ -322,6 +641,14 @@ def error(title="", text="", width=DEFAULT_WIDTH,
     :param timeout: close the window after n seconds
     :type timeout: int
     """
+    return _wait(error_async(title, text, width, height, timeout))
+
+
+def error_async(title="", text="", width=DEFAULT_WIDTH,
+                height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like error, but returns immediately with a Future for the response
+    """
     return _simple_dialog(Gtk.MessageType.ERROR,
                           text, title, width, height, timeout)
 
@@ -342,16 +669,27 @@ def warning(title="", text="", width=DEFAULT_WIDTH,
     :param timeout: close the window after n seconds
     :type timeout: int
     """
+    return _wait(warning_async(title, text, width, height, timeout))
+
+
+def warning_async(title="", text="", width=DEFAULT_WIDTH,
+                  height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like warning, but returns immediately with a Future for the response
+    """
     return _simple_dialog(Gtk.MessageType.WARNING,
                           text, title, width, height, timeout)
 
 
-def question(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None):
+def question(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None,
+             details=None):
     """
     Display a question, possible answer are yes/no.
 
     :param text: text inside the window
     :type text: str
+    :param details: optional details, shown as plain text in a scrollable pane below the text
+    :type details: str
     :param title: title of the window
     :type title: str
     :param width: window width
@@ -363,17 +701,63 @@ def question(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, time
     :return: The answer as a boolean
     :rtype: bool
     """
-    response = _simple_dialog(Gtk.MessageType.QUESTION, text, title, width, height, timeout)
+    return _wait(question_async(title, text, width, height, timeout, details))
+
+
+def _yes_no(response):
     if response == Gtk.ResponseType.YES:
         return True
     elif response == Gtk.ResponseType.NO:
         return False
     return None
 
-def questionAndPassword(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None):
-    if question(title, text, width, height, timeout):
-        return (True, password(title="password", text="Enter password"))
-    return (False, None)
+
+def question_async(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None,
+                   details=None):
+    """
+    Like question, but returns immediately with a Future for the answer
+    """
+    if details is not None:
+        dialog = lambda: ZDetailQuestion(text, details, title,
+                                         width, max(height, 500), timeout)
+    else:
+        dialog = lambda: ZSimpleDialog(Gtk.MessageType.QUESTION, text,
+                                       title, width, height, timeout)
+    return _show(dialog, _yes_no)
+
+
+def questionAndPassword(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None,
+                        details=None):
+    return _wait(questionAndPassword_async(title, text, width, height, timeout, details))
+
+
+def questionAndPassword_async(title="", text="", width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None,
+                              details=None):
+    """
+    Asks the question, and if answered yes, asks for a password. Both dialogs
+    are shown on the same main loop, chained by callbacks.
+
+    :return: Future resolving to (approved, password); approved is None if the
+             question was closed (or timed out) without an answer
+    """
+    future = Future()
+
+    def on_password(pw):
+        if pw.exception() is not None:
+            future.set_exception(pw.exception())
+        else:
+            future.set_result((True, pw.result()))
+
+    def on_answer(answer):
+        if answer.exception() is not None:
+            future.set_exception(answer.exception())
+        elif answer.result():
+            password_async(title="password", text="Enter password").add_done_callback(on_password)
+        else:
+            future.set_result((answer.result(), None))
+
+    question_async(title, text, width, height, timeout, details).add_done_callback(on_answer)
+    return future
 
            
 def entry(text="", placeholder="", title="",
@@ -396,10 +780,16 @@ def entry(text="", placeholder="", title="",
     :return: The content of the text input
     :rtype: str
     """
-    dialog = ZEntryMessage(text, placeholder, title,
-                           width, height, timeout)
-    dialog.run()
-    return dialog.response
+    return _wait(entry_async(text, placeholder, title, width, height, timeout))
+
+
+def entry_async(text="", placeholder="", title="",
+                width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like entry, but returns immediately with a Future for the input
+    """
+    return _show(lambda: ZEntryMessage(text, placeholder, title,
+                                       width, height, timeout))
 
 
 def password(text="", placeholder="", title="",
@@ -422,15 +812,21 @@ def password(text="", placeholder="", title="",
     :return: The content of the text input
     :rtype: str
     """
-    dialog = ZEntryPassword(text, placeholder, title,
-                            width, height, timeout)
-    dialog.run()
-    return dialog.response
+    return _wait(password_async(text, placeholder, title, width, height, timeout))
+
+
+def password_async(text="", placeholder="", title="",
+                   width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like password, but returns immediately with a Future for the input
+    """
+    return _show(lambda: ZEntryPassword(text, placeholder, title,
+                                        width, height, timeout))
 
 
 def zlist(columns, items, print_columns=None,
           text="", title="", width=DEFAULT_WIDTH,
-          height=DEFAULT_HEIGHT, timeout=None):
+          height=DEFAULT_HEIGHT, timeout=None, multiple=False, select_all=False):
     """
     Display a list of values
 
@@ -450,13 +846,62 @@ def zlist(columns, items, print_columns=None,
     :type height: int
     :param timeout: close the window after n seconds
     :type timeout: int
-    :return: A row of values from the table
+    :param multiple: allow selecting several rows
+    :type multiple: bool
+    :param select_all: start with all rows selected (with multiple)
+    :type select_all: bool
+    :return: A row of values from the table, or a list of them with multiple
     :rtype: list
     """
-    dialog = ZList(columns, items, print_columns,
-                   text, title, width, height, timeout)
-    dialog.run()
-    return dialog.response
+    return _wait(zlist_async(columns, items, print_columns,
+                             text, title, width, height, timeout, multiple, select_all))
+
+
+def zlist_async(columns, items, print_columns=None,
+                text="", title="", width=DEFAULT_WIDTH,
+                height=DEFAULT_HEIGHT, timeout=None, multiple=False, select_all=False):
+    """
+    Like zlist, but returns immediately with a Future for the selected row(s)
+    """
+    return _show(lambda: ZList(columns, items, print_columns,
+                               text, title, width, height, timeout,
+                               multiple=multiple, select_all=select_all))
+
+
+def batchReview(columns, items, text="", title="", width=DEFAULT_WIDTH,
+                height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Display a number of requests, to be approved or rejected in one go
+
+    :param columns: a list of columns name, not including the index column
+    :type columns: list of strings
+    :param items: the values of all rows, row by row, each row starting with
+                  the index of the request
+    :type items: list of strings
+    :param text: text inside the window
+    :type text: str
+    :param title: title of the window
+    :type title: str
+    :param width: window width
+    :type width: int
+    :param height: window height
+    :type height: int
+    :param timeout: close the window after n seconds
+    :type timeout: int
+    :return: The indexes to approve and the password (([], None) if all were
+             rejected), or None if the window was closed without an answer
+    :rtype: tuple
+    """
+    return _wait(batchReview_async(columns, items, text, title, width, height, timeout))
+
+
+def batchReview_async(columns, items, text="", title="", width=DEFAULT_WIDTH,
+                      height=DEFAULT_HEIGHT, timeout=None):
+    """
+    Like batchReview, but returns immediately with a Future for the answer
+    """
+    return _show(lambda: ZBatchReview(columns, items, text,
+                                      title, width, height, timeout))
 
 
 def scale(text="", value=0, min=0 ,max=100, step=1, draw_value=True, title="",
@@ -487,7 +932,5 @@ def scale(text="", value=0, min=0 ,max=100, step=1, draw_value=True, title="",
     :return: The value selected by the user
     :rtype: float
     """
-    dialog = ZScale(text, value, min, max, step,
-                    draw_value, title, width, height, timeout)
-    dialog.run()
-    return dialog.response
+    return _wait(_show(lambda: ZScale(text, value, min, max, step,
+                                      draw_value, title, width, height, timeout)))
@@ -0,0 +1,170 @@
+"""
+Latency histograms and counters, exported in the Prometheus text format, either
+as a file rewritten periodically (for the node exporter's textfile collector), or
+over a unix socket:
+
+    curl --unix-socket /run/user/1000/gtksigner.metrics http://localhost/metrics
+"""
+
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+log = logging.getLogger("gtkui")
+
+# Seconds; from parsing a message up to a human thinking it over
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for (k, v) in sorted(labels.items())) + "}"
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """
+    A registry of histograms, counters and gauges. All methods are thread safe.
+    """
+    def __init__(self, prefix="gtkui"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, seconds, **labels):
+        """ Adds an observation to the histogram name{labels} """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        """ Increments the counter name{labels} """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, func):
+        """ Registers a gauge, whose value is read from func() when rendering """
+        self.gauges[name] = func
+
+    def time(self, name, **labels):
+        """ Context manager observing the time spent in the block """
+        return _Timer(self, name, labels)
+
+    def render(self):
+        """ Renders all metrics in the Prometheus text format """
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            # Copy the histograms, so rendering does not hold up observers
+            histograms = [(key, (list(h.counts), h.sum, h.count, h.buckets)) for (key, h) in histograms]
+
+        seen = set()
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.help:
+                lines.append("# HELP {}_{} {}".format(self.prefix, name, self.help[name]))
+            lines.append("# TYPE {}_{} {}".format(self.prefix, name, kind))
+
+        for ((name, labels), (counts, total, count, buckets)) in histograms:
+            header(name, "histogram")
+            labels = dict(labels)
+            cumulative = 0
+            for (bound, n) in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += n
+                lines.append("{}_{}_bucket{} {}".format(
+                    self.prefix, name, _labels(dict(labels, le=bound)), cumulative))
+            lines.append("{}_{}_sum{} {}".format(self.prefix, name, _labels(labels), total))
+            lines.append("{}_{}_count{} {}".format(self.prefix, name, _labels(labels), count))
+
+        for ((name, labels), value) in counters:
+            header(name, "counter")
+            lines.append("{}_{}{} {}".format(self.prefix, name, _labels(dict(labels)), value))
+
+        for (name, func) in sorted(self.gauges.items()):
+            header(name, "gauge")
+            lines.append("{}_{} {}".format(self.prefix, name, func()))
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path, interval=10):
+        """ Rewrites the metrics to the file every interval seconds, on a background thread """
+        def loop():
+            while True:
+                try:
+                    with open(path + ".tmp", "w") as f:
+                        f.write(self.render())
+                    os.replace(path + ".tmp", path)
+                except OSError as e:
+                    log.warning("Could not write metrics to %s: %s", path, e)
+                time.sleep(interval)
+        threading.Thread(target=loop, name="metrics-file", daemon=True).start()
+
+    def serve_unix(self, path):
+        """ Answers every connection on the unix socket with the metrics, as plain HTTP """
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen(4)
+
+        def loop():
+            while True:
+                (conn, addr) = server.accept()
+                with conn:
+                    try:
+                        # The request itself does not matter
+                        conn.settimeout(1)
+                        conn.recv(4096)
+                        body = self.render().encode('utf-8')
+                        conn.sendall(b"HTTP/1.0 200 OK\r\n"
+                                     b"Content-Type: text/plain; version=0.0.4\r\n" +
+                                     "Content-Length: {}\r\n\r\n".format(len(body)).encode('ascii') +
+                                     body)
+                    except OSError:
+                        pass
+        threading.Thread(target=loop, name="metrics-socket", daemon=True).start()
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.monotonic() - self.start, **self.labels)
+        return False
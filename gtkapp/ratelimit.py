@@ -0,0 +1,54 @@
+"""
+Rate limits per key (e.g. the origin of a request), as token buckets: a key may
+make up to `burst` calls at once, and then `rate` calls per second on average.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter(object):
+    """
+    :param rate: calls per second allowed per key, on average; 0 for no limit
+    :type rate: float
+    :param burst: calls allowed per key at once
+    :type burst: int
+    :param max_keys: max number of buckets kept; the least recently used ones
+                     are dropped, which only forgets keys that are idle anyway
+    :type max_keys: int
+    """
+    def __init__(self, rate, burst, max_keys=1024):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> (tokens, time of last refill), least recently used first
+        self.buckets = OrderedDict()
+
+    def delay(self, key, cost=1):
+        """
+        Takes cost tokens from the bucket of the key.
+
+        :return: 0 if they were there, else the seconds until they will be (in
+                 which case nothing is taken)
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            (tokens, last) = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def allow(self, key, cost=1):
+        """ Takes cost tokens from the bucket of the key, if they are there """
+        return self.delay(key, cost) == 0
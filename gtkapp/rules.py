@@ -0,0 +1,142 @@
+"""
+Auto-approval rules. A rules file lists requests which are routine enough to be
+answered without asking, e.g.
+
+    {
+      "rules": [
+        {"name": "wallet listing", "method": "ApproveListing",
+         "origin": "http://localhost:3000", "decision": "approve"},
+        {"name": "token transfers", "method": "ApproveTx",
+         "to": "0x...", "selector": "0xa9059cbb", "max_value": "0",
+         "decision": "approve", "password_file": "~/.clef/token.pw"},
+        {"name": "no new accounts", "method": "ApproveNewAccount",
+         "decision": "reject"}
+      ]
+    }
+
+The origin of a request is its Origin header if it has one, else its scheme and
+remote host. The header is chosen by the client: any program able to reach clef
+can claim a dapp's origin, and with it that dapp's rules. Only approve by origin
+what you would approve for every local program.
+
+Rules are compiled into a dict keyed by (method, origin, to, selector), where
+a missing field is a wildcard. Matching a request is a fixed number of dict
+lookups, no matter how many rules there are. When several rules share a key,
+the first one (in file order) which allows the request wins.
+"""
+
+import json
+import os
+
+METHODS = ("ApproveTx", "ApproveSignData", "ApproveListing", "ApproveNewAccount")
+DECISIONS = ("approve", "reject")
+
+# Approving these requires the keystore password
+NEEDS_PASSWORD = ("ApproveTx", "ApproveSignData", "ApproveNewAccount")
+
+
+def _lower(value):
+    return value.lower() if value else None
+
+
+def _wei(value):
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value
+    return int(value, 16) if value.startswith("0x") else int(value)
+
+
+class Rule(object):
+    def __init__(self, spec):
+        self.name = spec.get("name") or "unnamed"
+        self.method = spec.get("method")
+        self.decision = spec.get("decision")
+        if self.method not in METHODS:
+            raise ValueError("rule '{}': unknown method '{}'".format(self.name, self.method))
+        if self.decision not in DECISIONS:
+            raise ValueError("rule '{}': decision must be one of {}".format(self.name, DECISIONS))
+
+        self.origin = spec.get("origin")
+        # 'address' (the signing account) is the index key for ApproveSignData
+        self.to = _lower(spec.get("to") or spec.get("address"))
+        self.selector = _lower(spec.get("selector"))
+        self.max_value = _wei(spec["max_value"]) if "max_value" in spec else None
+
+        self.password = None
+        if self.decision == "approve" and self.method in NEEDS_PASSWORD:
+            if not spec.get("password_file"):
+                raise ValueError("rule '{}': approving {} needs a password_file".format(
+                    self.name, self.method))
+            with open(os.path.expanduser(spec["password_file"])) as f:
+                self.password = f.read().rstrip("\n")
+
+    @property
+    def approved(self):
+        return self.decision == "approve"
+
+    def key(self):
+        return (self.method, self.origin, self.to, self.selector)
+
+    def allows(self, req):
+        """ Checks the constraints which are not part of the index key """
+        if self.max_value is None:
+            return True
+        value = _wei(req.get("transaction", {}).get("value"))
+        return value <= self.max_value
+
+    def __str__(self):
+        return "'{}' ({} {})".format(self.name, self.decision, self.method)
+
+
+class RuleSet(object):
+    """
+    A compiled set of rules.
+
+    :param rules: the rule specifications
+    :type rules: list of dicts
+    """
+    def __init__(self, rules):
+        self.index = {}
+        for spec in rules:
+            rule = Rule(spec)
+            self.index.setdefault(rule.key(), []).append(rule)
+
+    @classmethod
+    def load(cls, path):
+        """ Compiles the rules file on the given path """
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(spec.get("rules", []))
+
+    def __len__(self):
+        return sum(len(x) for x in self.index.values())
+
+    def match(self, method, req, origin):
+        """
+        Finds the rule which decides the request, if any.
+
+        :param method: the request method, e.g. ApproveTx
+        :param req: the request
+        :param origin: where the request came from
+        :return: the matching Rule, or None
+        """
+        to = None
+        selector = None
+        if method == "ApproveTx":
+            tx = req.get("transaction", {})
+            to = _lower(tx.get("to"))
+            data = tx.get("data") or tx.get("input") or ""
+            if len(data) >= 10:
+                selector = data[:10].lower()
+        elif method == "ApproveSignData":
+            to = _lower(req.get("address"))
+
+        # Most specific key first, any missing field is tried as a wildcard
+        for o in (origin, None):
+            for t in (to, None):
+                for sel in (selector, None):
+                    for rule in self.index.get((method, o, t, sel), ()):
+                        if rule.allows(req):
+                            return rule
+        return None
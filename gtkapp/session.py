@@ -0,0 +1,110 @@
+"""
+Unlock sessions: remembers the password of an account for a limited time and
+a limited number of uses, so that following requests only need a yes/no answer.
+
+Passwords are kept in a bytearray, which is overwritten with zeroes as soon as
+the session ends, whether by expiry, by running out of uses, or by locking.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger("gtkui")
+
+
+def _zero(buf):
+    buf[:] = bytes(len(buf))
+
+
+class Session(object):
+    def __init__(self, password, ttl, uses):
+        self.password = bytearray(password.encode('utf-8'))
+        self.expires = time.monotonic() + ttl
+        self.uses = uses
+        self.timer = None
+
+    def expired(self):
+        return self.uses <= 0 or time.monotonic() >= self.expires
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        _zero(self.password)
+
+
+class UnlockSessions(object):
+    """
+    Per account unlock sessions.
+
+    :param ttl: how long a session lasts, in seconds
+    :type ttl: int
+    :param uses: how many times the password may be used within a session
+    :type uses: int
+    """
+    def __init__(self, ttl, uses=10):
+        self.ttl = ttl
+        self.uses = uses
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def unlock(self, account, password):
+        """ Starts (or restarts) the session for the account """
+        if not account or not password:
+            return
+        session = Session(password, self.ttl, self.uses)
+        session.timer = threading.Timer(self.ttl, self._expire, (account.lower(), session))
+        session.timer.daemon = True
+        with self.lock:
+            old = self.sessions.pop(account.lower(), None)
+            self.sessions[account.lower()] = session
+        if old is not None:
+            old.close()
+        session.timer.start()
+
+    def active(self, account):
+        """ Whether the account currently has a session """
+        if not account:
+            return False
+        with self.lock:
+            session = self.sessions.get(account.lower())
+            return session is not None and not session.expired()
+
+    def use(self, account):
+        """
+        Uses the session of the account once.
+
+        :return: the password, or None if there is no (valid) session
+        """
+        if not account:
+            return None
+        with self.lock:
+            session = self.sessions.get(account.lower())
+            if session is None:
+                return None
+            if session.expired():
+                del self.sessions[account.lower()]
+                session.close()
+                return None
+            session.uses -= 1
+            password = session.password.decode('utf-8')
+            if session.uses <= 0:
+                del self.sessions[account.lower()]
+                session.close()
+            return password
+
+    def lock_all(self):
+        """ Ends all sessions """
+        with self.lock:
+            (sessions, self.sessions) = (self.sessions, {})
+        for session in sessions.values():
+            session.close()
+        if sessions:
+            log.info("Locked %d unlock session(s)", len(sessions))
+
+    def _expire(self, account, session):
+        with self.lock:
+            if self.sessions.get(account) is not session:
+                return
+            del self.sessions[account]
+        session.close()
@@ -0,0 +1,85 @@
+"""
+Single-flight de-duplication: while a call for a key is running, callers with
+the same key wait for it and share its result, instead of making the call again.
+Results are kept for a short while, for retries arriving just after the answer.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """
+    :param ttl: seconds a result is reused for after the call finished; 0 to only
+                share calls that are still running
+    :type ttl: float
+    :param max_entries: max number of results kept
+    :type max_entries: int
+    """
+    def __init__(self, ttl=0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.flights = {}
+        # key -> (expiry, result), in order of expiry since the ttl is the same for all
+        self.results = OrderedDict()
+
+    def do(self, key, func):
+        """
+        Calls func(), unless a call for the key is running or has just finished.
+
+        :return: (result, shared), where shared tells whether the result came
+                 from another call
+        """
+        with self.lock:
+            self._expire()
+            if key in self.results:
+                return (self.results[key][1], True)
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+        if not leader:
+            return (future.result(), True)
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self.lock:
+                del self.flights[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.flights[key]
+            if self.ttl > 0:
+                self.results[key] = (time.monotonic() + self.ttl, result)
+                while len(self.results) > self.max_entries:
+                    self.results.popitem(last=False)
+        future.set_result(result)
+        return (result, False)
+
+    def has(self, key):
+        """ Whether a result is kept for the key, so that do() would return at once """
+        with self.lock:
+            self._expire()
+            return key in self.results
+
+    def forget(self, key):
+        """ Drops the result kept for the key; a running call is not affected """
+        with self.lock:
+            self.results.pop(key, None)
+
+    def clear(self):
+        """ Drops all kept results """
+        with self.lock:
+            self.results.clear()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.results:
+            (key, (expiry, result)) = next(iter(self.results.items()))
+            if expiry > now:
+                break
+            del self.results[key]
@@ -1,11 +1,57 @@
 #!/usr/bin/env python3
 
-from gtkapp import *
-import os,sys, subprocess
+import gtkapp
+from gtkapp.backends import BACKENDS, get_backend
+from gtkapp.rules import RuleSet
+from gtkapp.session import UnlockSessions
+from gtkapp.fourbyte import SelectorIndex, decodeCall
+from gtkapp.metrics import Metrics
+from gtkapp.audit import AuditJournal
+from gtkapp.singleflight import SingleFlight
+from gtkapp.ratelimit import RateLimiter
+import os,sys, subprocess, threading, queue, signal, logging, time, json, hashlib, io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
 from tinyrpc.transports import ServerTransport
-from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
 from tinyrpc.dispatch import public, RPCDispatcher
 from tinyrpc.server import RPCServer
+from tinyrpc.exc import RPCError
+
+log = logging.getLogger("gtkui")
+
+# Values longer than this are cut short in the summary, the details pane has them in full
+SUMMARY_MAX = 66
+
+def abbreviate(value):
+    value = str(value)
+    if len(value) <= SUMMARY_MAX:
+        return value
+    return "{}... ({} characters, see details)".format(value[:SUMMARY_MAX], len(value))
+
+def hexLines(data, width=64):
+    """ Breaks hex data into lines of one 32-byte word each; many short lines lay
+    out much faster in a text view than one huge line """
+    if data.startswith('0x'):
+        data = data[2:]
+    return "\n".join(data[i:i + width] for i in range(0, len(data), width))
+
+class Details(str):
+    """ Text for the details pane, along with the size and sha256 of the raw payload
+    it shows: what a dialog shows instead, when the text is too large to display """
+    def __new__(cls, text, payload):
+        details = str.__new__(cls, text)
+        details.size = len(payload)
+        details.sha256 = hashlib.sha256(payload).hexdigest()
+        return details
+
+def payloadDetails(text, data):
+    """ Details for hex payload data; the hash is over the payload bytes, which the
+    user can check against the payload they sent """
+    try:
+        return Details(text, bytes.fromhex(data[2:] if data.startswith('0x') else data))
+    except ValueError:
+        return text
 
 tx_template ="""
 -- Transaction details -----------------
@@ -14,7 +60,7 @@ to:         {to}
 from:       {from}
 value:      {value}
 data:       {data}
-
+{call}
 -- Validation details ------------------
 
 {info}
@@ -24,7 +70,22 @@ data:       {data}
 {metastr}
 
 """
-def txToText(req):
+def callToText(tx, selectors):
+    """ Describes the function called by the tx, if the selector is known """
+    selector = txSelector(tx)
+    if not selector or selectors is None:
+        return ''
+    signature = selectors.lookup(selector)
+    if signature is None:
+        return ''
+    try:
+        data = bytes.fromhex((tx.get('data') or tx.get('input'))[2:])
+    except ValueError:
+        return "\ncall:       {}\n".format(signature)
+    args = "\n".join(["  *  {} : {}".format(typ, abbreviate(value)) for (typ, value) in decodeCall(signature, data)])
+    return "\ncall:       {}\n{}\n".format(signature, args)
+
+def txToText(req, selectors=None):
     info = ''
     tx = req['transaction']
     if 'call_info' in req.keys():
@@ -35,7 +96,18 @@ def txToText(req):
         meta = "\n".join(["  *  {k} : {v}".format(k=k,v=v) for k,v in req['meta'].items()])
 
 
-    return tx_template.format( **tx, metastr=meta, info=info)
+    fields = {'to': '', 'from': '', 'value': '', 'data': ''}
+    fields.update(tx)
+    fields['data'] = abbreviate(fields['data'] or '')
+    return tx_template.format( **fields, metastr=meta, info=info, call=callToText(tx, selectors))
+
+def txDetails(req):
+    """ The full tx data, for the details pane """
+    tx = req['transaction']
+    data = tx.get('data') or tx.get('input')
+    if not data:
+        return "(no data)"
+    return payloadDetails("data ({} bytes):\n{}".format(len(data) // 2 - 1, hexLines(data)), data)
 
 signdata_template = """
 -- Signing details ---------------------
@@ -57,16 +129,24 @@ def signDataToText(req):
     if 'meta' in req.keys():
         meta = "\n".join(["  *  {k} : {v}".format(k=k,v=v) for k,v in req['meta'].items()])
 
-    return signdata_template.format(**req, metastr=meta)
+    fields = {'address': '', 'message': '', 'raw_data': '', 'hash': ''}
+    fields.update(req)
+    fields['message'] = abbreviate(repr(fields['message']))
+    fields['raw_data'] = abbreviate(fields['raw_data'])
+    return signdata_template.format(**fields, metastr=meta)
+
+def signDataDetails(req):
+    """ The full message and raw data, for the details pane """
+    return payloadDetails("message:\n{}\n\nraw data:\n{}".format(req.get('message', ''),
+                                                                    hexLines(req.get('raw_data') or '')),
+                          req.get('raw_data') or '')
 
 list_template = """
 -- Listing  details --------------------
 A request has been made to list all accounts. 
-The following accounts are available listing:
-
-{accountlist}
+{count} accounts are available for listing.
 
-Approve to list these accounts?
+Select the accounts to list (Ctrl+A for all).
 
 -- Request details ---------------------
 
@@ -78,12 +158,14 @@ def listingToText(req):
     if 'meta' in req.keys():
         meta = "\n".join(["  *  {k} : {v}".format(k=k,v=v) for k,v in req['meta'].items()])
 
+    return list_template.format( metastr=meta, count = len(req.get('accounts') or []))
 
-    accountlist = ''
-    if 'accounts' in req.keys() and req['accounts'] is not None:
-        accountlist = "\n".join(["  *  {address}".format(**x) for x in req['accounts']])
-
-    return list_template.format( metastr=meta, accountlist = accountlist)
+def listingItems(req):
+    """ The account rows of the listing dialog, flattened """
+    items = []
+    for account in req.get('accounts') or []:
+        items.extend([account.get('address', ''), account.get('url', '')])
+    return items
 
 newAccount_template = """
 -- Details --------------------
@@ -103,6 +185,70 @@ def newAccountToText(req):
     return newAccount_template.format(metastr = meta)
 
 
+def requestOrigin(req):
+    """ Returns a short description of where a request came from, based on its meta.
+    This is the Origin header when there is one, which the client is free to choose:
+    good for display, not for telling clients apart (see requestPeer) """
+    meta = req.get('meta') or {}
+    if meta.get('Origin'):
+        return meta['Origin']
+    return requestPeer(req)
+
+def requestPeer(req):
+    """ The scheme and remote host of a request, from its meta; unlike the Origin
+    header, not up to the client """
+    meta = req.get('meta') or {}
+    # The remote port differs for every connection, only keep the host
+    remote = (meta.get('remote') or '').rsplit(':', 1)[0]
+    return "{}://{}".format(meta.get('scheme', ''), remote)
+
+def requestParams(request):
+    """ The request object clef passes as the only parameter of a UI method """
+    args = getattr(request, 'args', None)
+    if args and isinstance(args[0], dict):
+        return args[0]
+    return {}
+
+def requestDigest(req):
+    """ The sha256 of the request as canonical json (sorted keys, no whitespace) """
+    canonical = json.dumps(req, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def accountsDigest(accounts):
+    """ The sha256 of a set of accounts (address and url), in any order """
+    canonical = sorted(["{}|{}".format((a.get('address') or '').lower(), a.get('url') or '')
+                        for a in accounts])
+    return hashlib.sha256("\n".join(canonical).encode('utf-8')).hexdigest()
+
+def requestKey(method, req):
+    """ Identifies identical requests, for de-duplication. The meta is reduced to the
+    origin, since the remote port differs for every connection """
+    return "{}:{}".format(method, requestDigest(dict(req, meta=requestOrigin(req))))
+
+def txSelector(tx):
+    """ Returns the 4-byte function selector of the tx data, or '' """
+    data = tx.get('data') or tx.get('input') or ''
+    if len(data) < 10:
+        return ''
+    return data[:10]
+
+def weiToText(value):
+    from decimal import Decimal
+
+    if not value:
+        return "0 ETH"
+    wei = int(value, 16) if isinstance(value, str) else int(value)
+    return "{} ETH".format(Decimal(wei) / Decimal(10**18))
+
+def reviewRow(kind, req):
+    """ Returns the (type, to, value, selector, origin) columns describing a request """
+    if kind == "ApproveTx":
+        tx = req['transaction']
+        return [kind, tx.get('to') or '(contract creation)', weiToText(tx.get('value')),
+                txSelector(tx), requestOrigin(req)]
+    return [kind, req.get('address', ''), '', '', requestOrigin(req)]
+
+
 """ This is a POC example of how to write a custom UI for the signer. The UI starts the 
 signer process with the '--stdio-ui' option, and communicates with the signer binary
 using standard input / output.
@@ -124,6 +270,22 @@ class StdIOTransport(ServerTransport):
     def send_reply(self, context, reply):
         print(reply)
 
+# Fields of replies to clef holding a keystore password, never to be logged
+SECRET_FIELDS = ("password", "old_password", "new_password")
+
+def redacted(message):
+    """ A message to or from the signer, fit for the log: passwords are blanked out """
+    def blank(value):
+        if isinstance(value, dict):
+            return {k: "<redacted>" if k in SECRET_FIELDS and v else blank(v) for (k, v) in value.items()}
+        if isinstance(value, list):
+            return [blank(v) for v in value]
+        return value
+    try:
+        return json.dumps(blank(json.loads(message)))
+    except ValueError:
+        return "<{} bytes, not json>".format(len(message))
+
 class PipeTransport(ServerTransport):
     """ Uses std a pipe for RPC """
 
@@ -133,19 +295,465 @@ class PipeTransport(ServerTransport):
 
     def receive_message(self):
         data = self.input.readline()
-        print(">> {}".format( data))
+        if not data:
+            raise EOFError("signer closed the connection")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(">> %s", redacted(urlparse.unquote(data)))
         return None, urlparse.unquote(data)
 
     def send_reply(self, context, reply):
-        print("<< {}".format( reply))
+        if isinstance(reply, bytes):
+            reply = reply.decode('utf-8')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("<< %s", redacted(reply))
         self.output.write(reply)
         self.output.write("\n")
 
+class FramedTransport(ServerTransport):
+    """ Newline delimited JSON over a pair of (binary) pipes.
+
+    Clef writes every message as one line of JSON, and JSON strings can't hold a raw
+    newline, so a message ends at the first newline; no need to scan or decode the
+    JSON itself. Input is read in large chunks and split with bytes.find. Messages
+    are handed to the protocol as bytes, with no unquoting and no extra copies.
+
+    The transport can be polled by a thread (receive_message), or be driven by the
+    main loop through an IO watch (watch).
+    """
+
+    def __init__(self, input, output, bufsize=1 << 20, max_message=64 << 20):
+        self.input = input.fileno()
+        self.output = output.fileno()
+        self.files = (input, output)
+        self.bufsize = bufsize
+        self.max_message = max_message
+        self.buffer = bytearray()
+        self.messages = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def feed(self, data):
+        """ Adds data read from the signer, and returns the messages it completes """
+        self.buffer += data
+        messages = []
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            if end > start:
+                messages.append(bytes(self.buffer[start:end]))
+            start = end + 1
+        del self.buffer[:start]
+        if len(self.buffer) > self.max_message:
+            raise ValueError("Message from signer exceeds {} bytes".format(self.max_message))
+        if log.isEnabledFor(logging.DEBUG):
+            for message in messages:
+                log.debug(">> %s", redacted(message))
+        return messages
+
+    def _read(self):
+        data = os.read(self.input, self.bufsize)
+        if not data:
+            raise EOFError("signer closed the connection")
+        return self.feed(data)
+
+    def receive_message(self):
+        while not self.messages:
+            self.messages = self._read()
+        return None, self.messages.pop(0)
+
+    def send_reply(self, context, reply):
+        if isinstance(reply, str):
+            reply = reply.encode('utf-8')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("<< %s", redacted(reply))
+        data = memoryview(reply + b"\n")
+        with self.lock:
+            # Once closed, the fd may have been reused for something else
+            if self.closed:
+                raise EOFError("signer connection closed")
+            while data:
+                data = data[os.write(self.output, data):]
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for f in self.files:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+
+    def watch(self, add_watch, on_message, on_close):
+        """ Reads from the signer whenever the main loop sees input, with no thread in between.
+
+        :param add_watch: registers a callback for when the input fd is readable
+        :param on_message: called with (context, message) for every message
+        :param on_close: called once the signer closes the connection
+        """
+        def readable():
+            try:
+                messages = self._read()
+            except (EOFError, OSError, ValueError) as e:
+                log.info("Signer connection closed: %s", e)
+                on_close()
+                return False
+            for message in messages:
+                on_message(None, message)
+            return True
+        add_watch(self.input, readable)
+
+
+APPROVAL_METHODS = ("ApproveTx", "ApproveSignData", "ApproveExport",
+                    "ApproveImport", "ApproveListing", "ApproveNewAccount")
+
+class RateLimited(Exception):
+    def __init__(self, peer, delay):
+        super(RateLimited, self).__init__(peer, delay)
+        self.peer = peer
+        self.delay = delay
+
+
+class ApprovalQueue():
+    """ A bounded queue of approvals waiting for a dialog, and the pool of workers
+    answering them. Servers of several signers may share one, so that they all
+    take turns on the same dialogs.
+
+    With a limiter, each peer (see requestPeer) may only queue approvals at the
+    rate it allows; a flooding dapp is turned away before it fills the queue. The
+    Origin header is no key for this, a dapp could send a new one every time.
+    Only approvals which need a dialog are queued (see ConcurrentRPCServer), so
+    what rules and remembered answers decide is never limited.
+    """
+
+    def __init__(self, workers=4, max_pending=32, metrics=None, limiter=None):
+        self.pending = queue.Queue(max_pending)
+        self.limiter = limiter
+        self.metrics = metrics or Metrics()
+        self.metrics.gauge("pending_approvals", self.pending.qsize)
+        for i in range(workers):
+            threading.Thread(target=self._worker,
+                             name="approval-{}".format(i), daemon=True).start()
+
+    def put(self, server, context, request, start):
+        """ Queues an approval for the server. Never blocks.
+        :raises queue.Full: if too many approvals are waiting already
+        :raises RateLimited: if the peer of the request is over its rate limit """
+        if self.pending.full():
+            raise queue.Full()
+        if self.limiter is not None:
+            peer = requestPeer(requestParams(request))
+            delay = self.limiter.delay(peer)
+            if delay:
+                raise RateLimited(peer, delay)
+        self.pending.put_nowait((server, context, request, start))
+
+    def _worker(self):
+        while True:
+            (server, context, request, start) = self.pending.get()
+            self.metrics.observe("queued_seconds", time.monotonic() - start, method=request.method)
+            server._handle(context, request, start)
+
+
+class ConcurrentRPCServer(RPCServer):
+    """ An RPC server which never stops reading from the signer.
+
+    Requests are parsed as soon as they arrive. Approvals, which wait for a human,
+    are parked in a bounded queue and answered by a pool of approval workers.
+    Everything else (ShowInfo, ShowError, ...) is dispatched right away, and so
+    are approvals which triage(method, params) says need no dialog.
+    Replies are written whenever they are ready; the signer matches them to
+    the requests by their JSON-RPC id, so the order does not matter.
+    """
+
+    def __init__(self, transport, protocol, dispatcher, workers=4, max_pending=32, metrics=None,
+                 approvals=None, triage=None):
+        super(ConcurrentRPCServer, self).__init__(transport, protocol, dispatcher)
+        self.triage = triage
+        self.immediate = ThreadPoolExecutor(max_workers=2)
+        self.reply_lock = threading.Lock()
+        self.metrics = metrics or Metrics()
+        self.approvals = approvals or ApprovalQueue(workers, max_pending, self.metrics)
+
+    def receive_one_message(self):
+        context, message = self.transport.receive_message()
+        self.handle_message(context, message)
+
+    def serve_watch(self, add_watch, on_close):
+        """ Serves requests from the main loop, instead of from serve_forever """
+        self.transport.watch(add_watch, self.handle_message, on_close)
+
+    def handle_message(self, context, message):
+        """ Parses a request, and hands it to the approval queue or dispatches it. Never blocks. """
+        if callable(self.trace):
+            self.trace('-->', context, message)
+        start = time.monotonic()
+        try:
+            request = self.protocol.parse_request(message)
+        except RPCError as e:
+            self.metrics.inc("requests_total", method="invalid", decision="error")
+            self._reply(context, e.error_respond())
+            return
+        method = getattr(request, 'method', None)
+        self.metrics.observe("parse_seconds", time.monotonic() - start, method=method)
+        self.metrics.inc("received_bytes_total", len(message))
+
+        if method not in APPROVAL_METHODS or not self._needsDialog(method, request):
+            self.immediate.submit(self._handle, context, request, start)
+            return
+        try:
+            self.approvals.put(self, context, request, start)
+        except queue.Full:
+            self.metrics.inc("requests_total", method=method, decision="overloaded")
+            self._reply(context, request.error_respond(
+                "Too many pending approvals ({}), request rejected".format(self.approvals.pending.maxsize)))
+        except RateLimited as e:
+            log.info("Rejected %s from %s: over the rate limit", method, e.peer)
+            self.metrics.inc("requests_total", method=method, decision="rate_limited")
+            self._reply(context, request.error_respond(
+                "Too many approval requests from {}, request rejected; retry in {:.0f}s".format(
+                    e.peer, max(1, e.delay))))
+
+    def _needsDialog(self, method, request):
+        if self.triage is None:
+            return True
+        try:
+            return self.triage(method, requestParams(request))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            # Malformed, the handler will have to deal with it
+            return True
+
+    def _handle(self, context, request, start):
+        method = getattr(request, 'method', None)
+        with self.metrics.time("handle_seconds", method=method):
+            response = self.dispatcher.dispatch(request)
+        decision = responseDecision(response)
+        if decision == "timed_out":
+            # Unanswered (None) so far, for the metrics and the audit journal;
+            # clef wants a yes or a no
+            response.result['approved'] = False
+        if response is not None:
+            self._reply(context, response)
+        self.metrics.inc("requests_total", method=method, decision=decision)
+        self.metrics.observe("request_seconds", time.monotonic() - start, method=method)
+
+    def _reply(self, context, response):
+        result = response.serialize()
+        # Replies come from several threads, never interleave them
+        with self.reply_lock, self.metrics.time("reply_seconds"):
+            if callable(self.trace):
+                self.trace('<--', context, result)
+            self.transport.send_reply(context, result)
+
+
+def responseDecision(response):
+    """ Classifies a response for the metrics: approved, rejected, timed_out, error or none """
+    if response is None:
+        return "none"
+    if getattr(response, 'error', None) is not None:
+        return "error"
+    return resultDecision(getattr(response, 'result', None))
+
+
+def resultDecision(result):
+    """ Classifies the result of a handler method: approved, rejected, timed_out or none """
+    if isinstance(result, dict):
+        if 'approved' in result:
+            # A dialog closed without an answer leaves None
+            return {True: "approved", None: "timed_out"}.get(result['approved'], "rejected")
+        if 'accounts' in result:
+            return "approved" if result['accounts'] else "rejected"
+    return "none"
+
+
+def describeMetrics(metrics):
+    metrics.describe("parse_seconds", "Time to parse a request from the signer")
+    metrics.describe("queued_seconds", "Time an approval waited in the queue for a worker")
+    metrics.describe("handle_seconds", "Time to handle a request, including any dialogs")
+    metrics.describe("request_seconds", "Time from receiving a request to replying to it")
+    metrics.describe("reply_seconds", "Time to write a reply to the signer")
+    metrics.describe("dialog_show_seconds", "Time from requesting a dialog until it is shown")
+    metrics.describe("dialog_think_seconds", "Time a dialog was open, waiting for the user")
+    metrics.describe("requests_total", "Requests handled, by method and decision")
+    metrics.describe("received_bytes_total", "Bytes of requests received from the signer")
+    metrics.describe("pending_approvals", "Approvals waiting for a worker")
+
+
+class ReviewQueue():
+    """ Collects ApproveTx / ApproveSignData requests, so that a burst of them can be
+    reviewed in one batch dialog instead of a question and a password per request.
+
+    A lone request gets the usual dialogs. While a review is open, new requests
+    are gathered and shown in the next review once it closes. A review only holds
+    requests of one signer, since they are approved with one password.
+    """
+
+    columns = ["Type", "To", "Value", "Selector", "Origin"]
+
+    def __init__(self, gather=0.5, ui=gtkapp):
+        self.gather = gather
+        self.ui = ui
+        self.lock = threading.Lock()
+        self.items = []
+        self.busy = False
+
+    def submit(self, kind, req, title, text, details=None, label=None):
+        """ Queues a request for review.
+        :param label: the signer the request is for
+        :return: a Future resolving to (approved, password)
+        """
+        future = Future()
+        with self.lock:
+            self.items.append((kind, req, title, text, details, future, label))
+            if not self.busy:
+                self.busy = True
+                threading.Timer(self.gather, self._review).start()
+        return future
+
+    def _review(self):
+        with self.lock:
+            label = self.items[0][6]
+            batch = [item for item in self.items if item[6] == label]
+            self.items = [item for item in self.items if item[6] != label]
+        if len(batch) == 1:
+            (kind, req, title, text, details, future, label) = batch[0]
+            answer = self.ui.questionAndPassword_async(title=title, text=text, width=500, details=details)
+            answer.add_done_callback(lambda f: self._done(batch, f, lambda r: [r]))
+            return
+
+        rows = []
+        for (i, (kind, req, title, text, details, future, label)) in enumerate(batch):
+            rows.extend([str(i)] + reviewRow(kind, req))
+        title = "{} requests".format(len(batch))
+        answer = self.ui.batchReview_async(self.columns, rows, width=900, height=400,
+                                   title="[{}] {}".format(label, title) if label else title,
+                                   text="Select the requests to approve, the others are rejected")
+        answer.add_done_callback(lambda f: self._done(batch, f, partial(self._fanOut, len(batch))))
+
+    def _fanOut(self, n, response):
+        if response is None:
+            # Closed without an answer
+            return [(None, None)] * n
+        (selected, pw) = response
+        return [(True, pw) if i in selected else (False, None) for i in range(n)]
+
+    def _done(self, batch, answer, fanOut):
+        """ Resolves the futures of the batch from the answer of the review dialog """
+        try:
+            answers = fanOut(answer.result())
+            for ((kind, req, title, text, details, future, label), result) in zip(batch, answers):
+                future.set_result(result)
+        except Exception as e:
+            for (kind, req, title, text, details, future, label) in batch:
+                if not future.done():
+                    future.set_exception(e)
+        with self.lock:
+            if self.items:
+                threading.Timer(0, self._review).start()
+            else:
+                self.busy = False
+
 
 class StdIOHandler():
 
-    def __init__(self):
-        pass
+    def __init__(self, review=None, rules=None, sessions=None, selectors=None, ui=gtkapp,
+                 audit=None, flights=None, label=None, listings=None):
+        """
+        :param ui: the dialog backend (see gtkapp.backends), gtk dialogs by default
+        :param audit: journal to record every decision in (an AuditJournal)
+        :param flights: identical requests share the dialogs (and answer) of the
+                        first one, through this SingleFlight
+        :param label: name of the signer, shown in every dialog (with several signers)
+        :param listings: accounts approved for listing are remembered here (a
+                         SingleFlight), per origin and set of accounts, and handed
+                         out again without asking
+        """
+        self.label = label
+        self.listings = listings
+        self.ui = ui
+        self.audit = audit
+        self.flights = flights
+        self.review = review
+        self.rules = rules
+        self.sessions = sessions
+        self.selectors = selectors
+
+    def _title(self, title):
+        if self.label is None:
+            return title
+        return "[{}] {}".format(self.label, title)
+
+    def needsDialog(self, method, req):
+        """ Whether answering the request opens a dialog; False if it is decided by
+        a rule, by a remembered answer, or by default """
+        if self.rules is not None and self.rules.match(method, req, requestOrigin(req)) is not None:
+            return False
+        if method in ("ApproveTx", "ApproveSignData"):
+            return self.flights is None or not self.flights.has(requestKey(method, req))
+        if method == "ApproveListing":
+            return self.listings is None or not self.listings.has(self._listingKey(req))
+        return method not in ("ApproveExport", "ApproveImport")
+
+    def _listingKey(self, req):
+        # A new or removed account changes the key, and the origin is asked again.
+        # The Origin header is up to the client, so the consent is tied to its
+        # remote host as well
+        return "{}|{}:{}".format(requestPeer(req), requestOrigin(req),
+                                 accountsDigest(req.get('accounts') or []))
+
+    def _rule(self, method, req):
+        """ Returns the auto-approval rule deciding this request, if any """
+        if self.rules is None:
+            return None
+        rule = self.rules.match(method, req, requestOrigin(req))
+        if rule is not None:
+            log.info("Rule %s decided %s from %s", rule, method, requestOrigin(req))
+        return rule
+
+    def _decided(self, method, req, result, by, start, account=None):
+        """ Records the decision in the audit journal, if any, and returns the result """
+        if self.audit is not None:
+            record = {'method': method, 'origin': requestOrigin(req), 'digest': requestDigest(req),
+                      'decision': resultDecision(result), 'by': by, 'account': account,
+                      'seconds': round(time.monotonic() - start, 6)}
+            if self.label is not None:
+                record['signer'] = self.label
+            if 'accounts' in result:
+                record['accounts'] = [x.get('address') for x in result['accounts']]
+            self.audit.record(**record)
+        return result
+
+    def _questionAndPassword(self, kind, req, title, text, details, account):
+        """ :return: (approved, password, who decided: session, dialog or coalesced) """
+        if self.flights is None:
+            return self._ask(kind, req, title, text, details, account)
+        (answer, shared) = self.flights.do(requestKey(kind, req),
+                                           partial(self._ask, kind, req, title, text, details, account))
+        if shared:
+            log.info("Coalesced %s from %s with an identical request", kind, requestOrigin(req))
+            return answer[:2] + ("coalesced",)
+        return answer
+
+    def _ask(self, kind, req, title, text, details, account):
+        # With an unlock session for the account, a yes/no is all that's needed
+        if self.sessions is not None and self.sessions.active(account):
+            answer = self.ui.question(title="{} (unlocked)".format(title), text=text, width=500, details=details)
+            if not answer:
+                return (answer, None, "dialog")
+            pw = self.sessions.use(account)
+            if pw is not None:
+                return (True, pw, "session")
+            # The session ended while the question was open
+            return (True, self.ui.password(title="password", text="Enter password"), "dialog")
+
+        if self.review is not None:
+            (approved, pw) = self.review.submit(kind, req, title, text, details, self.label).result()
+        else:
+            (approved, pw) = self.ui.questionAndPassword(title=title, text=text, width=500, details=details)
+        if approved and self.sessions is not None:
+            self.sessions.unlock(account, pw)
+        return (approved, pw, "dialog")
 
     @public
     def ApproveTx(self,req):
@@ -155,12 +763,20 @@ class StdIOHandler():
         :param meta: metadata about the request, e.g. where the call comes from
         :return: 
         """
-        (approved, pw ) = questionAndPassword(title="Transaction request",text=txToText(req), width=500)
-        return {
+        start = time.monotonic()
+        account = req['transaction'].get('from')
+        rule = self._rule("ApproveTx", req)
+        if rule is not None:
+            (approved, pw, by) = (rule.approved, rule.password, "rule:" + rule.name)
+        else:
+            (approved, pw, by) = self._questionAndPassword("ApproveTx", req, self._title("Transaction request"),
+                                                           txToText(req, self.selectors), txDetails(req),
+                                                           account)
+        return self._decided("ApproveTx", req, {
             "approved" : approved,
-            "transaction" : tx,
+            "transaction" : req['transaction'],
             "password" : pw,
-        }
+        }, by, start, account)
 
     @public
     def ApproveSignData(self,req):
@@ -168,33 +784,61 @@ class StdIOHandler():
 
 
         """
-        (approved, pw ) = questionAndPassword(title="Sign data request",text=signDataToText(req), width=500)
-        return {"approved": False,
-                "password" : None}
+        start = time.monotonic()
+        rule = self._rule("ApproveSignData", req)
+        if rule is not None:
+            return self._decided("ApproveSignData", req, {"approved": rule.approved, "password": rule.password},
+                                 "rule:" + rule.name, start, req.get('address'))
+        (approved, pw, by) = self._questionAndPassword("ApproveSignData", req, self._title("Sign data request"),
+                                                       signDataToText(req), signDataDetails(req),
+                                                       req.get('address'))
+        return self._decided("ApproveSignData", req, {"approved": approved,
+                                                      "password" : pw}, by, start, req.get('address'))
 
     @public
     def ApproveExport(self,req):
         """ Example request
 
         """
-        return {"approved" : False}
+        return self._decided("ApproveExport", req, {"approved" : False}, "default", time.monotonic(),
+                             req.get('address'))
 
     @public
     def ApproveImport(self,req):
         """ Example request
         """
-        return {"approved" : False, "old_password": "", "new_password": ""}
+        return self._decided("ApproveImport", req, {"approved" : False, "old_password": "", "new_password": ""},
+                             "default", time.monotonic())
 
     @public
     def ApproveListing(self,req):
         """ Example request
         """
-        approved = question(title="Listing request",text=listingToText(req), width=500)
-
-        if approved and 'accounts' in req.keys():
-            return {'accounts' : req['accounts']}
-
-        return {'accounts': []}
+        start = time.monotonic()
+        accounts = req.get('accounts') or []
+        rule = self._rule("ApproveListing", req)
+        if rule is not None:
+            return self._decided("ApproveListing", req, {'accounts': accounts if rule.approved else []},
+                                 "rule:" + rule.name, start)
+
+        ask = partial(self.ui.zlist, ["Account", "URL"], listingItems(req), print_columns=0,
+                      title=self._title("Listing request"), text=listingToText(req),
+                      width=700, height=500, multiple=True)
+        by = "dialog"
+        if self.listings is None:
+            selected = ask()
+        else:
+            key = self._listingKey(req)
+            (selected, shared) = self.listings.do(key, ask)
+            if shared:
+                by = "remembered"
+            elif not selected:
+                # Don't keep refusing an origin for having been turned down once
+                self.listings.forget(key)
+        selected = set(selected or [])
+        return self._decided("ApproveListing", req,
+                             {'accounts': [x for x in accounts if x.get('address') in selected]},
+                             by, start)
 
     @public
     def ApproveNewAccount(self,req):
@@ -203,8 +847,13 @@ class StdIOHandler():
 
         :return:
         """
-        (approved, pw) = questionAndPassword(title="New account",text=newAccountToText(req))
-        return {"approved": approved, "password": pw}
+        start = time.monotonic()
+        rule = self._rule("ApproveNewAccount", req)
+        if rule is not None:
+            return self._decided("ApproveNewAccount", req, {"approved": rule.approved, "password": rule.password},
+                                 "rule:" + rule.name, start)
+        (approved, pw) = self.ui.questionAndPassword(title=self._title("New account"),text=newAccountToText(req))
+        return self._decided("ApproveNewAccount", req, {"approved": approved, "password": pw}, "dialog", start)
 
     @public
     def ShowError(self, req):
@@ -214,8 +863,12 @@ class StdIOHandler():
         :param text: to show
         :return: nothing
         """
-        error(req.get('text'))
-
+        self.ui.error_async(title=self._title("Signer error"), text=req.get('text') or "")
+        # The error may well be a wrong password, don't keep reusing it
+        if self.sessions is not None:
+            self.sessions.lock_all()
+        if self.flights is not None:
+            self.flights.clear()
         return
 
     @public
@@ -225,38 +878,203 @@ class StdIOHandler():
         :param text: to display
         :return:nothing
         """
-        message(req.get('text'))
+        self.ui.message_async(title=self._title("Signer info"), text=req.get('text') or "")
         return
 
 
-def connectHandler(cmd, handler):
+# Number of lines of the signer's stderr kept, to show when it crashes
+STDERR_LINES = 200
+
+def spawnSigner(cmd):
+    log.info("cmd: %s", " ".join(cmd))
+    # unbuffered, the transport does its own buffering
+    return subprocess.Popen(cmd, bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr = subprocess.PIPE)
+
+def drainStderr(proc, tail):
+    """ Copies the signer's stderr into the log, keeping the last lines in tail (a deque).
+    If nobody read it, the pipe would fill up, and the signer would block on its next log line.
+    :return: the thread doing it, which ends when the signer closes its stderr """
+    def drain():
+        for line in io.BufferedReader(proc.stderr):
+            line = line.decode('utf-8', 'replace').rstrip()
+            tail.append(line)
+            log.info("signer: %s", line)
+    thread = threading.Thread(target=drain, name="signer-stderr", daemon=True)
+    thread.start()
+    return thread
+
+def serveSigner(transport, handler, workers=4, max_pending=32, metrics=None, approvals=None):
+    """ Sets up the RPC server answering the requests coming in over the transport """
+    # Only needed once the signer runs, no need to load it before spawning it
+    from tinyrpc.protocols.jsonrpc import JSONRPCProtocol
+
     dispatcher = RPCDispatcher()
-    print("cmd: {}".format(" ".join(cmd)))
-    # line buffered
-    p = subprocess.Popen(cmd, bufsize=1, universal_newlines=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr = subprocess.PIPE)
-    transport = PipeTransport(p.stdout, p.stdin)
-    rpc_server = RPCServer(
+    rpc_server = ConcurrentRPCServer(
         transport,
         JSONRPCProtocol(),
-        dispatcher
+        dispatcher,
+        workers=workers,
+        max_pending=max_pending,
+        metrics=metrics,
+        approvals=approvals,
+        triage=getattr(handler, 'needsDialog', None)
     )
     dispatcher.register_instance(handler, '')
-    return (rpc_server, p)
+    return rpc_server
 
-def startSigner(path, test=False, handler = StdIOHandler):
+def connectHandler(cmd, handler, workers=4, max_pending=32, metrics=None):
+    p = spawnSigner(cmd)
+    drainStderr(p, deque(maxlen=STDERR_LINES))
+    return (serveSigner(FramedTransport(p.stdout, p.stdin), handler, workers, max_pending, metrics), p)
 
+def signerCommand(path, test=False, args=(), fourbyte=None):
     dir = os.path.dirname(path)
     cmd = ["{}/clef".format(dir),
-        "--4bytedb","{}/4byte.json".format(dir),
+        "--4bytedb", fourbyte or "{}/4byte.json".format(dir),
         "--stdio-ui","--rpc"]
 
     if test:
         cmd.extend(["--stdio-ui-test"])
-
-    (server, proc) = connectHandler(cmd, handler())
+    cmd.extend(args)
+    return cmd
+
+def loadSigners(path):
+    """ Reads the signers to run from a config file (json):
+
+        {"signers": [
+            {"name": "mainnet",
+             "signer": "/opt/clef/clef",
+             "args": ["--keystore", "/home/user/.clef/mainnet", "--chainid", "1", "--http.port", "8550"],
+             "fourbyte": "/opt/clef/4byte.json",
+             "expected_hash": "/opt/clef/clef.sha256",
+             "rules": "/home/user/.clef/mainnet-rules.json",
+             "test": false},
+            ...
+        ]}
+
+    Only name and signer are required. Names label the dialogs of each signer.
+    :return: list of signer specs (dicts), with all keys present
+    """
+    with open(path) as f:
+        config = json.load(f)
+    specs = []
+    for entry in config.get('signers') or []:
+        if not entry.get('name') or not entry.get('signer'):
+            raise ValueError("Every signer needs a name and a signer binary")
+        spec = {'args': [], 'fourbyte': None, 'expected_hash': None, 'rules': None, 'test': False}
+        spec.update(entry)
+        specs.append(spec)
+    if not specs:
+        raise ValueError("No signers configured")
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("Signer names must be unique")
+    return specs
+
+def startSigner(path, test=False, handler = StdIOHandler, workers=4, max_pending=32, metrics=None):
+    (server, proc) = connectHandler(signerCommand(path, test), handler(), workers, max_pending, metrics)
     return (handler, server, proc)
 
 
+class SupervisedSigner(ServerTransport):
+    """ Keeps the signer running: when it crashes, the cause is reported, and it is
+    restarted after a delay which doubles with every crash in a row.
+
+    It serves as the transport of the RPC server, for whichever signer process is
+    current. Every message comes with the transport of the process which sent it
+    as context, so that replies to a process which has since died are dropped,
+    instead of reaching its successor.
+
+    :param verify: called before every restart, returns an error to stop restarting
+    :param report: called with a description of every crash
+    :param stable: seconds a signer must have run for a crash to not count as "in a row"
+    """
+
+    def __init__(self, cmd, verify=None, report=None, backoff=1.0, max_backoff=60.0, stable=60.0):
+        self.cmd = cmd
+        self.verify = verify
+        self.report = report
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable = stable
+        self.failures = 0
+        self.stopped = False
+        self.tail = deque(maxlen=STDERR_LINES)
+        self.proc = None
+
+    def start(self):
+        self.proc = spawnSigner(self.cmd)
+        self.started = time.monotonic()
+        self.drainer = drainStderr(self.proc, self.tail)
+        self.transport = FramedTransport(self.proc.stdout, self.proc.stdin)
+
+    def kill(self):
+        """ Stops the signer for good """
+        self.stopped = True
+        if self.proc is not None:
+            self.proc.kill()
+
+    def send_reply(self, context, reply):
+        try:
+            context.send_reply(None, reply)
+        except (OSError, EOFError) as e:
+            log.warning("Dropped a reply, the signer it was for is gone: %s", e)
+
+    def watch(self, add_watch, on_message, on_close):
+        """ Like FramedTransport.watch, across restarts. on_close is called once the
+        signer exits normally, or won't be restarted """
+        (self.add_watch, self.on_message, self.on_close) = (add_watch, on_message, on_close)
+        self._watch(self.transport)
+
+    def _watch(self, transport):
+        transport.watch(self.add_watch,
+                        lambda context, message: self.on_message(transport, message),
+                        lambda: threading.Thread(target=self._recover, args=(transport, self.proc),
+                                                 name="signer-restart", daemon=True).start())
+
+    def _recover(self, transport, proc):
+        try:
+            code = proc.wait(5)
+        except subprocess.TimeoutExpired:
+            # It closed its stdout, but lives on; it is of no use like that.
+            # Not self.kill(): that would stop it for good, instead of restarting it
+            proc.kill()
+            code = proc.wait()
+        self.drainer.join(1)
+        if self.stopped or code == 0:
+            log.info("Signer exited with %s", code)
+            transport.close()
+            self.on_close()
+            return
+
+        ran = time.monotonic() - self.started
+        self.failures = 1 if ran > self.stable else self.failures + 1
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        cause = "\n".join(list(self.tail)[-10:])
+        log.error("Signer exited with %s after %.1fs, restarting in %.0fs", code, ran, delay)
+        if self.report is not None:
+            self.report("The signer stopped (exit code {}), it will be restarted in {:.0f} seconds.\n\n{}".format(
+                code, delay, cause))
+        time.sleep(delay)
+        # By now the main loop has stopped watching it
+        transport.close()
+
+        err = self.verify() if self.verify is not None else None
+        if err is not None or self.stopped:
+            if err is not None and self.report is not None:
+                self.report("The signer was not restarted:\n{}".format(err))
+            self.on_close()
+            return
+        self.tail.clear()
+        try:
+            self.start()
+        except OSError as e:
+            log.error("Could not restart the signer: %s", e)
+            self.on_close()
+            return
+        self._watch(self.transport)
+
+
 def check_perms(filepath):
     """ Validates the signer binary on the path given"""
     import os
@@ -272,68 +1090,330 @@ def check_perms(filepath):
 
     return None
 
-def check_hash(filepath):
-    import hashlib
+HASH_CACHE = os.path.expanduser("~/.cache/gtksigner/hashes.json")
+HASH_ALGOS = ("md5", "sha1", "sha256")
 
-    md5 = hashlib.md5()
-    sha1 = hashlib.sha1()
-    sha256 = hashlib.sha256()
+def _hash_file(filepath):
+    """ Hashes the file with all HASH_ALGOS at once, each on its own thread """
+    import hashlib
+    import mmap
 
     with open(filepath, 'rb') as f:
-        data = f.read(65536)
-        while data:
-            md5.update(data)
-            sha1.update(data)
-            sha256.update(data)
-            data = f.read(65536)
+        if os.fstat(f.fileno()).st_size == 0:
+            return {name: hashlib.new(name).hexdigest() for name in HASH_ALGOS}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # hashlib releases the GIL on large buffers, so these really run in parallel
+            with ThreadPoolExecutor(max_workers=len(HASH_ALGOS)) as pool:
+                digests = pool.map(lambda name: hashlib.new(name, data).hexdigest(), HASH_ALGOS)
+                return dict(zip(HASH_ALGOS, digests))
+
+def check_hash(filepath, cache=HASH_CACHE, fresh=False):
+    """ Returns the hashes of the file, as a dict. The hashes are cached, and only
+    recalculated when the file has changed (device, inode, size, mtime or ctime).
+
+    The cache is writable by the user, so it is only good for display: with fresh,
+    the hashes are always calculated (and the cache updated) """
+    import json
+
+    path = os.path.realpath(filepath)
+    st = os.stat(path)
+    key = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns]
+
+    entries = {}
+    try:
+        with open(cache) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        pass
 
-    print("Hashes for {}:".format(filepath))
-    print("{0}".format(md5.hexdigest()))
-    print("{0}".format(sha1.hexdigest()))
-    print("{0}".format(sha256.hexdigest()))
-    # At this point, we have nothing to validate against. 
-    return sha256.hexdigest()
+    entry = entries.get(path)
+    if not fresh and entry is not None and entry.get('stat') == key:
+        hashes = entry['hashes']
+    else:
+        hashes = _hash_file(path)
+        entries[path] = {'stat': key, 'hashes': hashes}
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            with open(cache + ".tmp", "w") as f:
+                json.dump(entries, f)
+            os.replace(cache + ".tmp", cache)
+        except OSError as e:
+            log.warning("Could not write hash cache %s: %s", cache, e)
+
+    log.info("Hashes for %s:", filepath)
+    for name in HASH_ALGOS:
+        log.info("%s %s", name, hashes[name])
+    return hashes
+
+def check_pinned(hashes, pinfile):
+    """ Checks the sha256 hash against the one in the pin file, which is either just
+    the hash, or in the format of sha256sum"""
+    with open(pinfile) as f:
+        fields = f.read().split()
+    if not fields:
+        return "ERR: No hash found in {}".format(pinfile)
+    if fields[0].lower() != hashes['sha256']:
+        return "ERR: Binary does not match the pinned hash.\n\texpected {}\n\tgot      {}".format(
+            fields[0].lower(), hashes['sha256'])
+    return None
+
+def verify_binary(filepath, pinfile=None):
+    """ Runs all checks on the signer binary
+    :return: an error message, or None if all is well"""
+    err = check_perms(filepath)
+    if err is not None:
+        return err
+    # Whoever can swap the binary can likely also write the cache: never check a
+    # pin against a cached hash
+    hashes = check_hash(filepath, fresh=pinfile is not None)
+    if pinfile is None:
+        # At this point, we have nothing to validate against.
+        return None
+    try:
+        return check_pinned(hashes, pinfile)
+    except OSError as e:
+        return "ERR: Cannot read pinned hash: {}".format(e)
 
 
 description= """
 This is a GUI for a signer, based on Gtk.
 """
-import argparse
-parser = argparse.ArgumentParser(description=description,formatter_class=argparse.RawDescriptionHelpFormatter)
 
-parser.add_argument(
-    '-s','--signer', type=str, required=True,
-    help="Signer binary (path)", default="/usr/bin/signer")
-
-parser.add_argument(
-    '-t','--test', type=bool, default=False,
-    help="Do a test-run")
+def makeParser():
+    """ Builds the argument parser; only needed when run as a program, not on import """
+    import argparse
+    parser = argparse.ArgumentParser(description=description,formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    signers = parser.add_mutually_exclusive_group(required=True)
+    signers.add_argument(
+        '-s','--signer', type=str,
+        help="Signer binary (path)")
+
+    signers.add_argument(
+        '--config', type=str,
+        help="Config file (json) listing several signers to run, see loadSigners")
+
+    parser.add_argument(
+        '-t','--test', type=bool, default=False,
+        help="Do a test-run")
+
+    parser.add_argument(
+        '--dialogs', type=int, default=4,
+        help="Max number of approval dialogs open at the same time")
+
+    parser.add_argument(
+        '--max-pending', type=int, default=32,
+        help="Max number of approvals waiting for a dialog, before new ones are rejected")
+
+    parser.add_argument(
+        '--rate-limit', type=float, default=60,
+        help="Max number of approval requests per minute from one remote host, on average; "
+             "more are rejected without asking (default 60, 0: no limit)")
+
+    parser.add_argument(
+        '--rate-burst', type=int, default=20,
+        help="Max number of approval requests from one remote host at once (default 20)")
+
+    parser.add_argument(
+        '--batch', action='store_true',
+        help="Review bursts of transactions and sign requests together, in one batch dialog")
+
+    parser.add_argument(
+        '--ui', type=str, choices=BACKENDS, default="gtk",
+        help="How to ask for approvals: gtk dialogs (default), on the terminal, or not at "
+             "all (policy: whatever the rules don't decide is rejected)")
+
+    parser.add_argument(
+        '--rules', type=str, default=None,
+        help="Rules file (json) listing requests to approve or reject without asking")
+
+    parser.add_argument(
+        '--unlock-ttl', type=int, default=0,
+        help="Remember an account password for this many seconds after an approval, "
+             "so following requests only need a yes/no (default 0: disabled). "
+             "Sessions are ended on screen lock or SIGUSR1")
+
+    parser.add_argument(
+        '--dedup-ttl', type=float, default=0,
+        help="Identical transaction and sign requests arriving while the first is open share "
+             "its answer. With this, so do those arriving up to this many seconds after it, "
+             "password included and without asking (default 0: not after)")
+
+    parser.add_argument(
+        '--unlock-uses', type=int, default=10,
+        help="Max number of approvals within one unlock session")
+
+    parser.add_argument(
+        '--listing-ttl', type=float, default=0,
+        help="Remember the accounts approved for listing to an origin (and remote host) for this "
+             "many seconds, as long as the accounts stay the same (default 0: always ask). "
+             "Origins are claimed by the client: any local program can claim a dapp's. "
+             "Forgotten on screen lock or SIGUSR1")
+
+    parser.add_argument(
+        '--audit', type=str, default=None,
+        help="Record every approval decision in this journal (query it with python3 -m gtkapp.audit)")
+
+    parser.add_argument(
+        '--expected-hash', type=str, default=None,
+        help="File with the expected sha256 of the signer binary (as written by sha256sum)")
+
+    parser.add_argument(
+        '-v', '--verbose', action='count', default=0,
+        help="Log more: -v for info, -vv to also log all traffic with the signer")
+
+    parser.add_argument(
+        '--metrics-file', type=str, default=None,
+        help="Write latency metrics to this file (Prometheus text format) every 10 seconds")
+
+    parser.add_argument(
+        '--metrics-socket', type=str, default=None,
+        help="Serve latency metrics (Prometheus text format) on this unix socket")
+    return parser
 
 
 def main(args):
     import os
-    binary = args.signer
-    bindir = os.path.dirname(os.path.realpath(binary))
-
-#    cmd = ["{}".format(binary),
-#        "--4bytedb","{}/4byte.json".format(bindir),
-#        "--stdio-ui"]
-#        "--stdio-ui-test"]
-
-    # Check as much as we can about the binary
-    sha_hash = check_hash(binary)
-
-    err = check_perms(binary)
-    if err is not None:
-        #sys.exit(0)
-        error("Failed to start signer!", err)
-        sys.exit(0)
-        pass # ... for now....
-
-
-    (handler, server, proc) = startSigner(binary, args.test)
-    server.serve_forever()
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)],
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.config:
+        # These are per signer in the config file
+        given = [flag for (flag, value) in (("--rules", args.rules), ("--expected-hash", args.expected_hash),
+                                            ("--test", args.test)) if value]
+        if given:
+            log.error("%s can't be combined with --config, set them per signer in the config file",
+                      ", ".join(given))
+            sys.exit(2)
+        try:
+            specs = loadSigners(args.config)
+        except (OSError, ValueError) as e:
+            log.error("Failed to load the signer config %s: %s", args.config, e)
+            sys.exit(1)
+    else:
+        specs = [{'name': None, 'signer': args.signer, 'args': [], 'fourbyte': None,
+                  'expected_hash': args.expected_hash, 'rules': args.rules, 'test': args.test}]
+
+    # Check as much as we can about the binaries. The checks run while the
+    # signers start up, but nothing is read from or sent to them until they pass.
+    checks = ThreadPoolExecutor(max_workers=len(specs))
+    signers = []
+    for spec in specs:
+        binary = spec['signer']
+        spec['verified'] = checks.submit(verify_binary, binary, spec['expected_hash'])
+        # Spawn the signer before loading anything else: it takes a while to come
+        # up, and Gtk (the bulk of our own startup) loads meanwhile
+        signer = SupervisedSigner(signerCommand(binary, spec['test'], spec['args'], spec['fourbyte']),
+                                  verify=partial(verify_binary, binary, spec['expected_hash']))
+        signer.start()
+        signers.append(signer)
+
+    def killAll():
+        for signer in signers:
+            signer.kill()
+
+    # The selector index is built on first use, don't hold up the startup for it
+    for spec in specs:
+        spec['selectors'] = None
+        fourbyte = spec['fourbyte'] or os.path.join(os.path.dirname(spec['signer']), "4byte.json")
+        if os.path.exists(fourbyte):
+            spec['selectors'] = SelectorIndex(fourbyte)
+            threading.Thread(target=spec['selectors'].open, name="4byte", daemon=True).start()
+
+    try:
+        ui = get_backend(args.ui)
+    except OSError as e:
+        killAll()
+        log.error("Cannot use the %s dialog backend: %s", args.ui, e)
+        sys.exit(1)
+    # Shared by the handlers of all signers
+    shared = {'ui': ui}
+
+    if args.audit:
+        try:
+            shared['audit'] = AuditJournal(args.audit)
+        except OSError as e:
+            killAll()
+            ui.error("Failed to open the audit journal!", "{}: {}".format(args.audit, e))
+            sys.exit(1)
+
+    workers = args.dialogs
+    if args.batch:
+        shared['review'] = ReviewQueue(ui=ui)
+        # Every pending approval must reach the review queue to be batched
+        workers = max(workers, args.max_pending)
+
+    metrics = Metrics()
+    describeMetrics(metrics)
+    ui.set_dialog_observer(lambda title, show, think: (
+        metrics.observe("dialog_show_seconds", show, dialog=title),
+        metrics.observe("dialog_think_seconds", think, dialog=title)))
+    if args.metrics_file:
+        metrics.write_file(args.metrics_file)
+    if args.metrics_socket:
+        metrics.serve_unix(args.metrics_socket)
+    # One queue for the approvals of all signers, answered on the same dialogs
+    approvals = ApprovalQueue(workers, args.max_pending, metrics,
+                              RateLimiter(args.rate_limit / 60.0, args.rate_burst))
+
+    # Answers remembered for later requests are forgotten on screen lock or SIGUSR1
+    forget = []
+    servers = []
+    for (spec, signer) in zip(specs, signers):
+        # Sessions and shared answers are per signer: keystores differ
+        options = dict(shared, label=spec['name'], selectors=spec['selectors'],
+                       flights=SingleFlight(args.dedup_ttl))
+        forget.append(options['flights'].clear)
+        if args.listing_ttl > 0:
+            options['listings'] = SingleFlight(args.listing_ttl)
+            forget.append(options['listings'].clear)
+        if spec['rules']:
+            try:
+                options['rules'] = RuleSet.load(spec['rules'])
+            except (OSError, ValueError) as e:
+                killAll()
+                ui.error("Failed to load rules!", "{}: {}".format(spec['rules'], e))
+                sys.exit(1)
+            log.info("Loaded %d rules from %s", len(options['rules']), spec['rules'])
+        if args.unlock_ttl > 0:
+            options['sessions'] = UnlockSessions(args.unlock_ttl, args.unlock_uses)
+            forget.append(options['sessions'].lock_all)
+
+        handler = StdIOHandler(**options)
+        # Crashes are shown like any other signer error
+        signer.report = lambda text, handler=handler: handler.ShowError({'text': text})
+        servers.append(serveSigner(signer, handler, metrics=metrics, approvals=approvals))
+    lock = lambda: [f() for f in forget]
+    ui.on_unix_signal(signal.SIGUSR1, lock)
+    ui.on_screen_lock(lock)
+
+    for spec in specs:
+        err = spec['verified'].result()
+        if err is not None:
+            killAll()
+            if spec['name'] is not None:
+                err = "{}: {}".format(spec['name'], err)
+            ui.error("Failed to start signer!", err)
+            sys.exit(0)
+    checks.shutdown()
+
+    # The UI runs until all signers have stopped
+    running = [len(servers)]
+    running_lock = threading.Lock()
+    def closed():
+        with running_lock:
+            running[0] -= 1
+            if running[0] == 0:
+                ui.quit_main_loop()
+
+    # Requests are read and parsed on the main loop, as soon as the signers send
+    # them. Approvals wait for their answers on worker threads, all dialogs are
+    # shown on this same main loop (a selector loop, for the headless backends).
+    for server in servers:
+        server.serve_watch(ui.watch_fd, closed)
+    ui.run_main_loop()
+    if 'audit' in shared:
+        shared['audit'].close()
 
 if __name__ == '__main__':
-    options = parser.parse_args()
+    options = makeParser().parse_args()
     main(options)
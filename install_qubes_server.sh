@@ -2,3 +2,7 @@ echo "Copying service to /etc/qubes-rpc"
 sudo cp qubes.Clefsign /etc/qubes-rpc/
 sudo chmod +x /etc/qubes-rpc/ qubes.Clefsign
 
+
+echo "Copying channel service to /etc/qubes-rpc"
+sudo cp qubes.ClefsignChannel /etc/qubes-rpc/
+sudo chmod +x /etc/qubes-rpc/qubes.ClefsignChannel
@@ -1,24 +1,384 @@
 """
 This implements a dispatcher which listens to localhost:8550, and proxies
 requests via qrexec to the service qubes.EthSign on a target domain
+
+JSON-RPC batches are split up, their calls forwarded concurrently, and the
+replies put back together in order: a batch takes as long as its slowest call.
 """
 
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import argparse
 import http.server
-import socketserver
+import itertools
+import json
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from qubesrpc import Channel, errorReply
 
 PORT=8550
 TARGET_DOMAIN= 'debian-work'
+QREXEC_CLIENT = '/usr/lib/qubes/qrexec-client'
+CHANNEL_SERVICE = 'user:/etc/qubes-rpc/qubes.ClefsignChannel'
+
+# Bodies are copied through buffers of this size
+BUFSIZE = 64 * 1024
+# Requests larger than this are refused
+MAX_REQUEST = 16 * 1024 * 1024
+
+
+# JSON-RPC error codes for a malformed request, and for one over the rate limit
+INVALID_REQUEST = -32600
+LIMIT_EXCEEDED = -32005
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+    Token buckets per client: up to `burst` requests at once, then `rate` per
+    second on average. The same as gtkapp.ratelimit, which is not installed in
+    the client domain.
+    """
+    def __init__(self, rate, burst, max_keys=1024):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def delay(self, key):
+        """ :return: 0 if the client may go ahead, else the seconds until it may """
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            (tokens, last) = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
 
 class Dispatcher(http.server.BaseHTTPRequestHandler):
-    
+
+    # Keep connections open between requests
+    protocol_version = "HTTP/1.1"
+    # Close idle keep-alive connections, so they don't hold on to a worker
+    timeout = 15
+
     def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        output = subprocess.check_output(['/usr/lib/qubes/qrexec-client','-d',TARGET_DOMAIN],
-             stdin = post_data)
-        self.wfile.write(output)
-
-with socketserver.TCPServer(("",PORT), Dispatcher) as httpd:
-    print("Serving at port", PORT)
-    httpd.serve_forever()
+        # By address only: headers such as Origin are up to the client to choose
+        client = self.client_address[0]
+        delay = self.server.limiter.delay(client)
+        if delay:
+            self._reject(429, "Too many requests from {}, retry in {:.0f}s".format(client, max(1, delay)),
+                         delay)
+            return
+        try:
+            body = self._body()
+            (length, output) = self.server.forward(body)
+        except RequestTooLarge:
+            # The rest of the body is still on the way, don't read it
+            self.close_connection = True
+            self.send_error(413, "Request larger than {} bytes".format(self.server.max_request))
+            return
+        except ValueError as e:
+            self.close_connection = True
+            self.send_error(400, str(e))
+            return
+        except (OSError, subprocess.CalledProcessError) as e:
+            # Part of the body may not have been read
+            self.close_connection = True
+            self.send_error(502, "Signer domain unavailable: {}".format(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            for chunk in output:
+                self.wfile.write(chunk)
+            return
+        # Streamed from the signer domain, the length is not known up front
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in output:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _reject(self, code, message, delay):
+        """ Answers with a JSON-RPC error, without reading the request body """
+        reply = errorReply(message, code=LIMIT_EXCEEDED)
+        self.close_connection = True
+        self.send_response(code)
+        self.send_header("Retry-After", str(max(1, int(delay + 0.5))))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def _body(self):
+        """ Returns an iterator over the request body, in chunks of at most BUFSIZE """
+        limit = self.server.max_request
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return self._chunked(limit)
+        if self.headers['Content-Length'] is None:
+            raise ValueError("Content-Length required")
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            raise ValueError("Invalid Content-Length")
+        if length < 0:
+            raise ValueError("Invalid Content-Length")
+        if length > limit:
+            raise RequestTooLarge()
+        return self._sized(length)
+
+    def _sized(self, length):
+        while length > 0:
+            chunk = self.rfile.read(min(length, BUFSIZE))
+            if not chunk:
+                raise ValueError("Request body truncated")
+            length -= len(chunk)
+            yield chunk
+
+    def _chunked(self, limit):
+        """ Decodes a chunked request body """
+        total = 0
+        while True:
+            line = self.rfile.readline(1024)
+            try:
+                # Chunk extensions, after a ';', are ignored
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ValueError("Invalid chunk size")
+            if size == 0:
+                break
+            total += size
+            if total > limit:
+                raise RequestTooLarge()
+            while size > 0:
+                chunk = self.rfile.read(min(size, BUFSIZE))
+                if not chunk:
+                    raise ValueError("Request body truncated")
+                size -= len(chunk)
+                yield chunk
+            self.rfile.readline(1024)
+        # Skip the trailers, up to the empty line
+        while self.rfile.readline(1024).strip():
+            pass
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """ Serves connections on a fixed pool of worker threads.
+
+    While all workers are busy, the accept loop waits for one to become free,
+    and new connections wait in the (bounded) listen backlog of the socket.
+    """
+
+    def __init__(self, address, handler, target=TARGET_DOMAIN, workers=8, backlog=32,
+                 qrexec=QREXEC_CLIENT, channel=True, max_request=MAX_REQUEST,
+                 limiter=None):
+        self.target = target
+        self.limiter = limiter or RateLimiter(0, 1)
+        self.qrexec = qrexec
+        self.max_request = max_request
+        self.channel = None
+        if channel:
+            self.channel = Channel([qrexec, '-d', target, CHANNEL_SERVICE])
+        self.request_queue_size = backlog
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Runs the calls of batches, without the channel
+        self.calls = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers)
+        super(PooledHTTPServer, self).__init__(address, handler)
+
+    def forward(self, body):
+        """ Sends a request body to the signer domain.
+
+        :param body: iterator over the chunks of the request body
+        :return: (length of the reply, or None if not known up front,
+                  iterator over the chunks of the reply)
+        """
+        # Enough of the body to tell a batch (a json array) from a single call
+        head = b""
+        for chunk in body:
+            head += chunk
+            if head.strip():
+                break
+        body = itertools.chain([head], body)
+        if self.channel is None and not head.lstrip().startswith(b"["):
+            return self._stream(body)
+
+        # Frames carry their length up front, and requests of all clients are
+        # interleaved on the channel, so the request is collected first (once,
+        # and handed on as it is)
+        data = bytearray()
+        for chunk in body:
+            data += chunk
+        reply = None
+        if head.lstrip().startswith(b"["):
+            reply = self._batch(data)
+        if reply is None:
+            reply = self.channel.call(data) if self.channel is not None else self._call(data)
+        reply = memoryview(reply)
+        return (len(reply), (reply[i:i + BUFSIZE] for i in range(0, len(reply), BUFSIZE)))
+
+    def _call(self, data):
+        """ One qrexec-client for one call """
+        return subprocess.run([self.qrexec, '-d', self.target],
+             input = data, stdout = subprocess.PIPE, check = True).stdout
+
+    def _batch(self, data):
+        """
+        Forwards the calls of a batch concurrently, and joins their replies.
+
+        :return: the reply to the batch, or None if data is not a batch after all
+                 (e.g. not valid json, which is left to the signer to answer)
+        """
+        try:
+            calls = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(calls, list):
+            return None
+        if not calls:
+            return errorReply("Empty batch", code=INVALID_REQUEST)
+
+        submit = self.channel.submit if self.channel is not None else \
+            lambda payload: self.calls.submit(self._call, payload)
+        futures = []
+        for call in calls:
+            if not isinstance(call, dict):
+                futures.append(None)
+                continue
+            futures.append(submit(json.dumps(call).encode('utf-8')))
+
+        replies = []
+        for (call, future) in zip(calls, futures):
+            if future is None:
+                replies.append(errorReply("Invalid request", code=INVALID_REQUEST))
+                continue
+            try:
+                reply = future.result().strip()
+            except (OSError, subprocess.CalledProcessError) as e:
+                reply = errorReply("Signer domain unavailable: {}".format(e), call.get("id"))
+            # Notifications are not answered
+            if "id" in call and reply:
+                replies.append(reply)
+        return b"[" + b",".join(replies) + b"]" if replies else b""
+
+    def _stream(self, body):
+        """ One qrexec-client per request, with both bodies streamed through it """
+        proc = subprocess.Popen([self.qrexec, '-d', self.target],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        errors = []
+
+        def send():
+            try:
+                for chunk in body:
+                    proc.stdin.write(chunk)
+            except (OSError, ValueError, RequestTooLarge) as e:
+                errors.append(e)
+                proc.kill()
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+        sender = threading.Thread(target=send, name="qrexec-send", daemon=True)
+        sender.start()
+
+        # Nothing is sent to the client until the first chunk of the reply is
+        # in, so that a failure up to there can still be answered with an error
+        first = proc.stdout.read1(BUFSIZE)
+        if not first:
+            sender.join()
+            code = proc.wait()
+            if errors:
+                raise errors[0]
+            if code != 0:
+                raise subprocess.CalledProcessError(code, proc.args)
+
+        def reply():
+            chunk = first
+            try:
+                while chunk:
+                    yield chunk
+                    chunk = proc.stdout.read1(BUFSIZE)
+            finally:
+                proc.stdout.close()
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+        return (None, reply())
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        self.pool.submit(self._work, request, client_address)
+
+    def _work(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super(PooledHTTPServer, self).server_close()
+        self.pool.shutdown(wait=False)
+        self.calls.shutdown(wait=False)
+        if self.channel is not None:
+            self.channel.close()
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--port', type=int, default=PORT,
+    help="Port to listen on (default {})".format(PORT))
+parser.add_argument('--domain', type=str, default=TARGET_DOMAIN,
+    help="Domain running the signer (default {})".format(TARGET_DOMAIN))
+parser.add_argument('--workers', type=int, default=8,
+    help="Max number of requests handled at the same time")
+parser.add_argument('--backlog', type=int, default=32,
+    help="Max number of connections waiting for a worker")
+parser.add_argument('--qrexec-client', type=str, default=QREXEC_CLIENT,
+    help="qrexec-client binary, or a local stand-in for testing")
+parser.add_argument('--no-channel', action='store_true',
+    help="Start one qrexec-client per request, instead of keeping one channel open")
+parser.add_argument('--max-request', type=int, default=MAX_REQUEST,
+    help="Max size of a request body, in bytes (default {})".format(MAX_REQUEST))
+parser.add_argument('--rate-limit', type=float, default=120,
+    help="Max number of requests per minute from one client address, on average; "
+         "more are answered with 429 (default 120, 0: no limit)")
+parser.add_argument('--rate-burst', type=int, default=40,
+    help="Max number of requests from one client at once (default 40)")
+
+def main(args):
+    with PooledHTTPServer(("", args.port), Dispatcher, args.domain,
+                          args.workers, args.backlog,
+                          args.qrexec_client, not args.no_channel,
+                          args.max_request,
+                          RateLimiter(args.rate_limit / 60.0, args.rate_burst)) as httpd:
+        print("Serving at port", args.port)
+        httpd.serve_forever()
+
+if __name__ == '__main__':
+    main(parser.parse_args())
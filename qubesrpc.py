@@ -0,0 +1,335 @@
+"""
+A framed, multiplexed channel for carrying JSON-RPC requests over qrexec.
+
+Instead of one qrexec-client process per request, the dispatcher keeps a single
+qrexec-client running against a resident service (qubes.ClefsignChannel) on the
+signer domain. Each request travels as one frame:
+
+    request id (4 bytes, big endian) | length (4 bytes, big endian) | payload
+
+and the reply comes back with the same request id. Requests are answered in
+whatever order the signer finishes them, so one slow approval does not hold
+back the others.
+
+It also holds the entry point of the services on the signer domain, which make
+sure the signer is up before forwarding anything to it:
+
+    qubesrpc.py oneshot   forward one request from stdin (qubes.Clefsign)
+    qubesrpc.py channel   serve the framed channel on stdin/stdout (qubes.ClefsignChannel)
+"""
+
+import fcntl
+import json
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+import http.client
+from concurrent.futures import Future, ThreadPoolExecutor
+
+HEADER = struct.Struct(">II")
+
+# Refuse frames larger than this, a corrupt header should not allocate gigabytes
+MAX_FRAME = 64 * 1024 * 1024
+
+SIGNER_HOST = "localhost"
+SIGNER_PORT = 8550
+
+SIGNER_BIN = "/home/user/tools/clef/clef"
+SIGNER_CMD = ["/home/user/tools/gtksigner/gtkui.py", "-s", SIGNER_BIN]
+LAUNCH_LOCK = "/home/user/.clef/gtksigner.lock"
+
+
+def write_frame(stream, rid, payload):
+    """ Writes one frame. The payload (any bytes-like object) is written as it is,
+    not copied; callers hold a lock, so the two writes don't interleave """
+    stream.write(HEADER.pack(rid, len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_frame(stream):
+    """
+    Reads one frame from the stream.
+
+    :return: (request id, payload), or None on a clean end of stream
+    """
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise EOFError("Truncated frame header")
+    (rid, length) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError("Frame too large: {} bytes".format(length))
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise EOFError("Truncated frame")
+    return (rid, payload)
+
+
+def errorReply(message, rid=None, code=-32603):
+    """ A JSON-RPC error reply, for when the request never reached the signer """
+    return json.dumps({"jsonrpc": "2.0", "id": rid,
+                       "error": {"code": code, "message": message}}).encode('utf-8')
+
+
+class _Connection(object):
+    """ One running qrexec-client, and the requests waiting for a reply on it """
+    def __init__(self, cmd):
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.pending = {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+
+class Channel(object):
+    """
+    Client side of the channel. Calls may be made from any number of threads.
+
+    :param cmd: command starting the other end, e.g. qrexec-client
+    :type cmd: list of strings
+    :param backoff: max delay between reconnection attempts, in seconds
+    :type backoff: float
+    """
+    def __init__(self, cmd, backoff=5.0):
+        self.cmd = cmd
+        self.max_backoff = backoff
+        self.lock = threading.Lock()
+        self.conn = None
+        self.next_id = 0
+        self.failures = 0
+
+    def _connection(self):
+        """ Returns the current connection, starting a new one if needed. Called with the lock held """
+        if self.conn is not None and not self.conn.closed:
+            return self.conn
+        if self.failures:
+            time.sleep(min(self.max_backoff, 0.1 * 2 ** (self.failures - 1)))
+        conn = _Connection(self.cmd)
+        threading.Thread(target=self._read, args=(conn,), name="channel-reader", daemon=True).start()
+        self.conn = conn
+        return conn
+
+    def call(self, payload, timeout=None):
+        """
+        Sends one request, and waits for its reply.
+
+        :param payload: the request body
+        :type payload: bytes
+        :return: the reply body
+        :rtype: bytes
+        """
+        return self.submit(payload).result(timeout)
+
+    def submit(self, payload):
+        """ Like call, but returns a Future for the reply """
+        future = Future()
+        for attempt in range(2):
+            with self.lock:
+                try:
+                    conn = self._connection()
+                except OSError as e:
+                    self.failures += 1
+                    future.set_exception(ConnectionError("Channel unavailable: {}".format(e)))
+                    return future
+                self.next_id = (self.next_id + 1) & 0xffffffff
+                rid = self.next_id
+                conn.pending[rid] = future
+                try:
+                    write_frame(conn.proc.stdin, rid, payload)
+                    return future
+                except (OSError, ValueError) as e:
+                    # The other end went away before the request was sent,
+                    # it is safe to try again on a new connection
+                    del conn.pending[rid]
+                    error = e
+            self._disconnect(conn, error)
+        future.set_exception(ConnectionError("Channel unavailable: {}".format(error)))
+        return future
+
+    def _read(self, conn):
+        error = EOFError("Channel closed")
+        try:
+            while True:
+                frame = read_frame(conn.proc.stdout)
+                if frame is None:
+                    break
+                (rid, payload) = frame
+                with self.lock:
+                    future = conn.pending.pop(rid, None)
+                    self.failures = 0
+                if future is not None:
+                    future.set_result(payload)
+        except (OSError, EOFError, ValueError) as e:
+            error = e
+        self._disconnect(conn, error)
+
+    def _disconnect(self, conn, error):
+        with self.lock:
+            if conn.closed:
+                return
+            if self.conn is conn:
+                self.conn = None
+            self.failures += 1
+            (pending, conn.pending) = (conn.pending, {})
+            conn.close()
+        for future in pending.values():
+            future.set_exception(ConnectionError("Channel lost: {}".format(error)))
+
+    def close(self):
+        with self.lock:
+            conn = self.conn
+        if conn is not None:
+            self._disconnect(conn, EOFError("Channel closed"))
+
+
+class SignerClient(object):
+    """ Forwards request bodies to the signer over HTTP, keeping one connection per thread """
+    def __init__(self, host=SIGNER_HOST, port=SIGNER_PORT):
+        self.host = host
+        self.port = port
+        self.local = threading.local()
+
+    def call(self, payload):
+        """ Sends the payload, and returns the reply body.
+
+        Only a request that never reached the signer is retried: the body may be a
+        transaction to approve, which must not be handed to the signer twice """
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is not None and _dropped(conn):
+                conn.close()
+                conn = None
+            reused = conn is not None
+            if conn is None:
+                conn = self.local.conn = http.client.HTTPConnection(self.host, self.port)
+            try:
+                conn.request("POST", "/", payload, {"Content-Type": "application/json"})
+            except (ConnectionResetError, BrokenPipeError):
+                # The signer closed the kept-alive connection before (all of) the
+                # request was written, so it can't have acted on it: reconnect once
+                self._drop(conn)
+                if not reused or attempt:
+                    raise
+                continue
+            except (OSError, http.client.HTTPException):
+                self._drop(conn)
+                raise
+            try:
+                return conn.getresponse().read()
+            except (OSError, http.client.HTTPException):
+                # The request went out, it may have been acted on
+                self._drop(conn)
+                raise
+
+    def _drop(self, conn):
+        conn.close()
+        self.local.conn = None
+
+
+def _dropped(conn):
+    """ Whether the server closed an idle keep-alive connection: one that is readable
+    while no request is outstanding has seen its end (or garbage) """
+    if conn.sock is None:
+        return False
+    return bool(select.select([conn.sock], [], [], 0)[0])
+
+
+def serve(instream, outstream, handle, workers=8):
+    """
+    Server side of the channel: reads frames until the end of the stream, and
+    answers each with handle(payload). Requests are handled concurrently.
+    """
+    lock = threading.Lock()
+
+    def work(rid, payload):
+        try:
+            reply = handle(payload)
+        except Exception as e:
+            reply = errorReply("Signer unavailable: {}".format(e))
+        with lock:
+            write_frame(outstream, rid, reply)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            frame = read_frame(instream)
+            if frame is None:
+                break
+            pool.submit(work, *frame)
+
+
+def ping(client):
+    """ Whether the signer answers a version call """
+    request = json.dumps({"jsonrpc": "2.0", "id": 0,
+                          "method": "account_version", "params": []})
+    try:
+        client.call(request.encode('utf-8'))
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def ensureSigner(client, cmd=SIGNER_CMD, lockfile=LAUNCH_LOCK, timeout=30):
+    """
+    Makes sure the signer is up and answering, starting the UI (which starts
+    the signer) if it is not. Concurrent callers are serialized on a lock file,
+    so the UI is started only once. Readiness is polled with exponential backoff.
+
+    :return: True once the signer answers, False if it did not within the timeout
+    """
+    if ping(client):
+        return True
+    os.makedirs(os.path.dirname(lockfile), exist_ok=True)
+    with open(lockfile, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Someone else may have started it while we waited for the lock
+        if ping(client):
+            return True
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.monotonic() + timeout
+        delay = 0.02
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            if ping(client):
+                return True
+            delay = min(delay * 2, 1.0)
+    return False
+
+
+def main(argv):
+    client = SignerClient()
+    if len(argv) != 1 or argv[0] not in ("oneshot", "channel"):
+        print("usage: qubesrpc.py oneshot|channel", file=sys.stderr)
+        return 2
+
+    if not ensureSigner(client):
+        reply = errorReply("Signer did not start")
+        if argv[0] == "oneshot":
+            sys.stdout.buffer.write(reply)
+            return 1
+        serve(sys.stdin.buffer, sys.stdout.buffer, lambda payload: reply)
+        return 1
+
+    if argv[0] == "oneshot":
+        sys.stdout.buffer.write(client.call(sys.stdin.buffer.read()))
+        return 0
+    serve(sys.stdin.buffer, sys.stdout.buffer, client.call)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))